@@ -2,6 +2,7 @@
 """
 Portable raw disk image flasher for Linux and macOS.
 Uses only Python standard library. External deps: sudo, umount/diskutil.
+Optional modules blake3, xxhash and crc32c add faster verification digests.
 WARNING: The selected target disk is completely overwritten.
 """
 
@@ -11,19 +12,39 @@ import bz2
 import curses
 import gzip
 import hashlib
+import json
 import lzma
+import mmap
 import os
 import platform
 import shutil
 import signal
+import sqlite3
 import subprocess
 import sys
 import tempfile
 import textwrap
 import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 import zipfile
 from pathlib import Path
+from queue import Queue
+
+try:
+    import blake3
+except ModuleNotFoundError:
+    blake3 = None
+try:
+    import crc32c
+except ModuleNotFoundError:
+    crc32c = None
+try:
+    import xxhash
+except ModuleNotFoundError:
+    xxhash = None
 
 PROGRAM_NAME = 'Image Flasher'
 BACKTITLE = PROGRAM_NAME
@@ -90,6 +111,8 @@ def raw_device(disk):
     return disk.replace('/dev/disk', '/dev/rdisk', 1) if OS == 'Darwin' else disk
 
 
+CHUNK_SIZE = 4 * 1024 * 1024
+
 COMPRESSION_OPENERS = {
     '.gz': gzip.open,
     '.bz2': bz2.open,
@@ -125,7 +148,7 @@ def unpack_image(image):
                 output = Path(_temp_dir) / Path(members[0].filename).name
                 with archive.open(members[0]) as src, output.open('wb') as dst:
                     copied = 0
-                    for chunk in iter(lambda: src.read(4 * 1024 * 1024), b''):
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
                         dst.write(chunk)
                         copied += len(chunk)
                         gauge.update(min(copied * 100 // members[0].file_size, 99))
@@ -134,7 +157,7 @@ def unpack_image(image):
                     COMPRESSION_OPENERS[suffix](raw, 'rb') as src, \
                     output.open('wb') as dst:
                 source_size = source.stat().st_size
-                for chunk in iter(lambda: src.read(4 * 1024 * 1024), b''):
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
                     dst.write(chunk)
                     gauge.update(min(raw.tell() * 100 // source_size, 99))
     except (OSError, EOFError, lzma.LZMAError, zipfile.BadZipFile) as exc:
@@ -153,20 +176,176 @@ def remove_unpacked_image(state):
         Path(unpacked).unlink(missing_ok=True)
 
 
-def write_all(destination, chunk):
-    """Write a full chunk or raise OSError instead of silently truncating it."""
+def pwrite_all(fd, chunk, offset):
+    """Write a full chunk at offset or raise OSError instead of truncating it."""
     view = memoryview(chunk)
     while view:
-        written = destination.write(view)
-        if written is None:
-            return
+        written = os.pwrite(fd, view, offset)
         if written <= 0:
             raise OSError('Device write made no progress.')
         view = view[written:]
+        offset += written
+
+
+WRITE_QUEUE_DEPTH = 4    # positional writes kept in flight on the device
+
+
+class WriteQueue:
+    """Keep several chunk writes outstanding at different device offsets.
+    Workers call os.pwrite (which releases the GIL), so the device sees a
+    queue depth > 1. Completions are reaped in submission order: `completed`
+    only covers the contiguous prefix that has really been written, which
+    keeps the progress bar honest if a later chunk finishes first.
+    """
+    def __init__(self, fd, depth=WRITE_QUEUE_DEPTH):
+        self._fd = fd
+        self._depth = depth
+        self._pending = deque()   # (end_offset, future) in submission order
+        self._pool = ThreadPoolExecutor(max_workers=depth,
+                                        thread_name_prefix='pwrite')
+        self.completed = 0
+
+    def submit(self, offset, chunk):
+        """Queue chunk for writing at offset, blocking while the queue is full."""
+        while len(self._pending) >= self._depth:
+            self._reap()
+        future = self._pool.submit(pwrite_all, self._fd, chunk, offset)
+        self._pending.append((offset + len(chunk), future))
+
+    def _reap(self):
+        end, future = self._pending.popleft()
+        future.result()   # re-raises the worker's OSError
+        self.completed = end
+
+    def drain(self):
+        """Wait for every queued write; raise the first error encountered."""
+        while self._pending:
+            self._reap()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+class MappedImage:
+    """Read-only mmap of an uncompressed image, handed out as memoryview
+    chunks so hashlib and the device writer see the page cache directly
+    instead of a fresh 4 MiB bytes object per read(). Pages are advised
+    sequential, and dropped with MADV_DONTNEED once `lag` chunks behind the
+    reader so a multi-GB image does not crowd out the page cache.
+    """
+    def __init__(self, path, chunk=CHUNK_SIZE, lag=WRITE_QUEUE_DEPTH):
+        self._path = path
+        self._chunk = chunk
+        self._lag = lag
+        self._file = None
+        self._map = None
+
+    def __enter__(self):
+        self._file = open(self._path, 'rb')
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._advise(getattr(mmap, 'MADV_SEQUENTIAL', None), 0, len(self._map))
+        return self
+
+    def __exit__(self, *exc):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass   # a consumer still holds a view; the GC unmaps it later
+        self._file.close()
+
+    def _advise(self, advice, start, length):
+        if advice is None or length <= 0 or not hasattr(self._map, 'madvise'):
+            return
+        try:
+            self._map.madvise(advice, start, length)
+        except OSError:
+            pass
+
+    def chunks(self):
+        """Yield consecutive memoryview slices of at most `chunk` bytes."""
+        if self._map is None:
+            return
+        dontneed = getattr(mmap, 'MADV_DONTNEED', None)
+        with memoryview(self._map) as view:
+            for start in range(0, len(view), self._chunk):
+                yield view[start:start + self._chunk]
+                behind = start - self._lag * self._chunk
+                if behind >= 0:
+                    self._advise(dontneed, behind, self._chunk)
+
+
+class _Crc32c:
+    """hashlib-style wrapper around the crc32c module's running checksum."""
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = crc32c.crc32c(data, self._value)
+
+    def hexdigest(self):
+        return f'{self._value:08x}'
+
+
+# Digest algorithms usable for verification. The non-cryptographic ones only
+# guard against corruption, which is all verification needs; they are listed
+# only when their optional module is installed.
+DIGESTS = {
+    'sha256': hashlib.sha256,
+    'blake2b': hashlib.blake2b,
+}
+if blake3:
+    DIGESTS['blake3'] = blake3.blake3
+if xxhash:
+    DIGESTS['xxh3'] = xxhash.xxh3_64
+    DIGESTS['xxh128'] = xxhash.xxh3_128
+if crc32c:
+    DIGESTS['crc32c'] = _Crc32c
+DEFAULT_DIGEST = 'xxh128' if xxhash else 'blake2b'
+
+
+class ThreadedDigest:
+    """Run a digest's update() on a dedicated thread so hashing overlaps the
+    reads feeding it. Chunks passed to update() must not change afterwards.
+    An exception raised by the digest is re-raised by the next update() or
+    by hexdigest().
+    """
+    def __init__(self, digest, depth=WRITE_QUEUE_DEPTH):
+        self._digest = digest
+        self._chunks = Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for chunk in iter(self._chunks.get, None):
+            if self._error is not None:
+                continue   # keep draining so update() never blocks
+            try:
+                self._digest.update(chunk)
+            except BaseException as e:
+                self._error = e
+
+    def _raise(self):
+        if self._error is not None:
+            raise self._error
+
+    def update(self, chunk):
+        self._raise()
+        self._chunks.put(chunk)
+
+    def hexdigest(self):
+        if self._thread.is_alive():
+            self._chunks.put(None)
+            self._thread.join()
+        self._raise()
+        return self._digest.hexdigest()
 
 
 def write_verification_log(image, device, image_size, bytes_read,
-                           source_hash, device_hash, details):
+                           source_hash, device_hash, details,
+                           algorithm='sha256'):
     """Write persistent diagnostics for a failed verification."""
     log = Path(tempfile.gettempdir()) / \
         f'image-flasher-verify-{datetime.now():%Y%m%d-%H%M%S}.log'
@@ -176,8 +355,8 @@ def write_verification_log(image, device, image_size, bytes_read,
         f'Device: {device}\n'
         f'Image size: {image_size} bytes\n'
         f'Bytes read: {bytes_read}\n'
-        f'Source SHA-256: {source_hash or "unavailable"}\n'
-        f'Device SHA-256: {device_hash}\n'
+        f'Source {algorithm}: {source_hash or "unavailable"}\n'
+        f'Device {algorithm}: {device_hash}\n'
         f'Details: {details}\n',
     )
     return str(log)
@@ -506,6 +685,58 @@ class Gauge:
 
 # ── Disk enumeration ──────────────────────────────────────────────────────────
 
+def _sysfs_model(entry):
+    """Return the model string of a /sys/block entry, or ''."""
+    for mpath in ('device/model', 'device/name'):
+        try:
+            return (entry / mpath).read_text().strip()
+        except OSError:
+            pass
+    return ''
+
+
+def disk_identity(disk):
+    """Return (model, serial, port) for disk, each '' when unknown.
+    On Linux the serial and port come from the nearest USB ancestor in
+    sysfs (port is its bus path, e.g. '2-1.3'), so hub ports can be told
+    apart across flashes.
+    """
+    model = serial = port = ''
+    if OS == 'Linux':
+        entry = Path('/sys/block') / Path(disk).name
+        model = _sysfs_model(entry)
+        try:
+            node = (entry / 'device').resolve()
+        except OSError:
+            return model, serial, port
+        while node != node.parent and node.name != 'devices':
+            if (node / 'idVendor').is_file():
+                port = node.name
+                try:
+                    serial = (node / 'serial').read_text().strip()
+                except OSError:
+                    pass
+                break
+            node = node.parent
+        if not serial:
+            try:
+                serial = (entry / 'device/serial').read_text().strip()
+            except OSError:
+                pass
+    elif OS == 'Darwin':
+        info = subprocess.run(
+            ['diskutil', 'info', disk], capture_output=True, text=True,
+        ).stdout
+        for iline in info.splitlines():
+            key, _, value = iline.partition(':')
+            key, value = key.strip(), value.strip()
+            if not model and key in ('Media Name', 'Device / Media Name'):
+                model = value
+            elif not port and key == 'Device Location':
+                port = value
+    return model, serial, port
+
+
 def list_disks():
     """Return (devices, labels) lists for physical disks."""
     devices, labels = [], []
@@ -526,13 +757,7 @@ def list_disks():
                 continue
             if sectors == 0:
                 continue
-            model = ''
-            for mpath in ('device/model', 'device/name'):
-                try:
-                    model = (entry / mpath).read_text().strip()
-                    break
-                except OSError:
-                    pass
+            model = _sysfs_model(entry)
             devices.append(dev)
             labels.append(f'{model or "Unknown"} — {format_size(sectors * 512)} — {dev}')
 
@@ -572,12 +797,134 @@ def list_images(images_dir):
     except OSError:
         return paths, labels
     for p in entries:
-        if p.is_file():
+        if p.is_file() and not p.name.endswith(SIDECAR_SUFFIXES):
             paths.append(str(p))
             labels.append(f'{p.name} — {format_size(p.stat().st_size)}')
     return paths, labels
 
 
+# ── Image index ───────────────────────────────────────────────────────────────
+# `--index` hashes every image once, in parallel, and leaves sidecars beside
+# it: <image>.blocks.json with the whole-image and per-block digests in the
+# selected algorithm and the sha256, and for uncompressed images also
+# <image>.sha256 (sha256sum format). Digests cover the decompressed content,
+# i.e. what ends up on the disk, so a compressed image gets no .sha256 that
+# `sha256sum -c` would check against the compressed file. verify_flash()
+# reuses a fresh .blocks.json instead of hashing the source image again; a
+# .sha256 file may come from elsewhere, e.g. a vendor's digest of the
+# compressed download, so it is never trusted for verification.
+
+SIDECAR_SUFFIXES = ('.sha256', '.blocks.json')
+
+
+def _image_chunks(path):
+    """Yield CHUNK_SIZE pieces of the decompressed image content."""
+    source = Path(path)
+    suffix = source.suffix.lower()
+    if suffix in UNSUPPORTED_COMPRESSION_SUFFIXES or \
+            (len(source.suffixes) > 1 and source.suffixes[-2].lower() == '.tar'):
+        raise ValueError(f'Compression format {suffix} is not supported.')
+    if suffix == '.zip':
+        with zipfile.ZipFile(source) as archive:
+            members = [member for member in archive.infolist() if not member.is_dir()]
+            if len(members) != 1:
+                raise ValueError('ZIP image must contain exactly one file.')
+            with archive.open(members[0]) as src:
+                yield from iter(lambda: src.read(CHUNK_SIZE), b'')
+    elif suffix in COMPRESSION_OPENERS:
+        with COMPRESSION_OPENERS[suffix](path, 'rb') as src:
+            yield from iter(lambda: src.read(CHUNK_SIZE), b'')
+    else:
+        with MappedImage(path) as src:
+            yield from src.chunks()
+
+
+def _is_compressed(path):
+    suffix = Path(path).suffix.lower()
+    return suffix == '.zip' or suffix in COMPRESSION_OPENERS
+
+
+def _digest_hex(algorithm, data):
+    h = DIGESTS[algorithm]()
+    h.update(data)
+    return h.hexdigest()
+
+
+def index_image(path, algorithm):
+    """Hash one image and write its sidecars. Runs in a worker process.
+    Returns (path, sha256 hex of the decompressed content or None, error
+    message).
+    """
+    sha = hashlib.sha256()
+    whole = sha if algorithm == 'sha256' else DIGESTS[algorithm]()
+    blocks = []
+    size = 0
+    try:
+        for chunk in _image_chunks(path):
+            sha.update(chunk)
+            if whole is not sha:
+                whole.update(chunk)
+            blocks.append(_digest_hex(algorithm, chunk))
+            size += len(chunk)
+        name = Path(path).name
+        if not _is_compressed(path):
+            Path(f'{path}.sha256').write_text(f'{sha.hexdigest()}  {name}\n')
+        Path(f'{path}.blocks.json').write_text(json.dumps({
+            'image': name,
+            'image_mtime': Path(path).stat().st_mtime,
+            'size': size,
+            'algorithm': algorithm,
+            'digest': whole.hexdigest(),
+            'sha256': sha.hexdigest(),
+            'block_size': CHUNK_SIZE,
+            'blocks': blocks,
+        }))
+    except (OSError, EOFError, ValueError, lzma.LZMAError, zipfile.BadZipFile) as exc:
+        return path, None, str(exc)
+    return path, sha.hexdigest(), ''
+
+
+def load_sidecar_digest(image, algorithm):
+    """Return the indexed digest of image in algorithm from the .blocks.json
+    sidecar written by --index, or None if there is none or the image
+    changed since it was indexed.
+    """
+    try:
+        mtime = Path(image).stat().st_mtime
+        meta = json.loads(Path(f'{image}.blocks.json').read_text())
+        if meta['image_mtime'] == mtime and meta['algorithm'] == algorithm:
+            return meta['digest']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def index_images(images_dir, algorithm, jobs=None):
+    """Hash every image in images_dir across a process pool.
+    Returns the number of images that could not be indexed.
+    """
+    paths, _ = list_images(images_dir)
+    if not paths:
+        print(f'No images found in {images_dir}.')
+        return 0
+    failed = 0
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(index_image, path, algorithm) for path in paths]
+        for future in as_completed(futures):
+            path, sha, err = future.result()
+            if err:
+                failed += 1
+                print(f'FAILED  {Path(path).name}: {err}')
+            elif _is_compressed(path):
+                print(f'{sha}  {Path(path).name} (decompressed)')
+            else:
+                print(f'{sha}  {Path(path).name}')
+    print(f'Indexed {len(paths) - failed} of {len(paths)} images in '
+          f'{time.monotonic() - started:.1f} s.')
+    return failed
+
+
 # ── Sudo ──────────────────────────────────────────────────────────────────────
 
 def obtain_sudo():
@@ -725,16 +1072,25 @@ def flash_image(state):
     disk = state['selected_disk']
     out_dev = raw_device(disk)
 
+    # warn before writing, not only after, when the model got slower
+    slow = model_speed_warning(state['history_db'], disk_identity(disk)[0])
     code = dlg_yesno(
         'Confirm destructive operation',
         f'Image:\n{state["selected_image_label"]}\n\n'
         f'Target:\n{state["selected_disk_label"]}\n\n'
-        'WARNING: All data on the target disk will be permanently overwritten.',
+        'WARNING: All data on the target disk will be permanently overwritten.'
+        + (f'\n\nSlow card: {slow}' if slow else ''),
         yes='Flash', no='Back',
     )
     if code != OK:
         return 2
 
+    state['flash_started'] = ''
+    state['image_digest'] = ''
+    state['image_bytes'] = 0
+    state['flash_samples'] = []
+    state['flash_seconds'] = state['verify_seconds'] = None
+
     image, err = unpack_image(state['selected_image'])
     if err:
         show_error(err)
@@ -746,6 +1102,7 @@ def flash_image(state):
         remove_unpacked_image(state)
         return 2
 
+    state['flash_started'] = datetime.now().isoformat()
     ok, err = unmount_target(disk)
     if not ok:
         show_error(err)
@@ -754,6 +1111,8 @@ def flash_image(state):
         return 1
 
     image_size = Path(image).stat().st_size
+    state['image_bytes'] = image_size
+    sampler = ThroughputSampler()
     gauge = Gauge(
         'Step 3 of 4 — Flashing',
         f'Writing {Path(image).name} to {disk}\n\n'
@@ -762,52 +1121,66 @@ def flash_image(state):
 
     # Python reads the image in chunks and writes directly (root) or via
     # a privileged `sudo python3` subprocess (non-root). No dd needed.
-    CHUNK = 4 * 1024 * 1024
     write_ok = True
     err_details = ''
 
     if os.getuid() == 0:
-        # Root: open the device directly.
+        # Root: open the device directly and keep several writes in flight.
         try:
-            with open(image, 'rb') as src, open(out_dev, 'wb') as dst:
-                written = 0
-                for chunk in iter(lambda: src.read(CHUNK), b''):
-                    write_all(dst, chunk)
-                    written += len(chunk)
-                    gauge.update(min(written * 100 // image_size, 99))
-                dst.flush()
-                os.fsync(dst.fileno())
+            with MappedImage(image) as src:
+                fd = os.open(out_dev, os.O_WRONLY)
+                queue = WriteQueue(fd)
+                try:
+                    offset = 0
+                    for chunk in src.chunks():
+                        queue.submit(offset, chunk)
+                        offset += len(chunk)
+                        gauge.update(min(queue.completed * 100 // image_size, 99))
+                        sampler.sample(queue.completed)
+                    queue.drain()
+                    os.fsync(fd)
+                finally:
+                    queue.close()
+                    os.close(fd)
         except OSError as e:
             write_ok = False
             err_details = str(e)
     else:
         # Non-root: open device via sudo python3 receiving data on stdin.
+        # The helper mirrors WriteQueue: up to 4 pwrites in flight.
         writer_script = (
             'import os,sys\n'
-            'f=open(sys.argv[1],"wb")\n'
-            'while True:\n'
-            ' c=sys.stdin.buffer.read(4194304)\n'
-            ' if not c:break\n'
+            'from concurrent.futures import ThreadPoolExecutor\n'
+            'def w(c,o):\n'
             ' v=memoryview(c)\n'
             ' while v:\n'
-            '  n=f.write(v)\n'
-            '  if not n:raise OSError("Device write made no progress.")\n'
-            '  v=v[n:]\n'
-            'f.flush()\n'
-            'os.fsync(f.fileno())\n'
-            'f.close()\n'
+            '  n=os.pwrite(fd,v,o)\n'
+            '  if n<=0:raise OSError("Device write made no progress.")\n'
+            '  v=v[n:];o+=n\n'
+            'fd=os.open(sys.argv[1],os.O_WRONLY)\n'
+            'q=[];o=0\n'
+            'with ThreadPoolExecutor(4) as p:\n'
+            ' while True:\n'
+            '  c=sys.stdin.buffer.read(4194304)\n'
+            '  if not c:break\n'
+            '  if len(q)>=4:q.pop(0).result()\n'
+            '  q.append(p.submit(w,c,o));o+=len(c)\n'
+            ' for f in q:f.result()\n'
+            'os.fsync(fd)\n'
+            'os.close(fd)\n'
         )
         writer_proc = subprocess.Popen(
             ['sudo', '-n', 'python3', '-c', writer_script, out_dev],
             stdin=subprocess.PIPE, stderr=subprocess.DEVNULL,
         )
         try:
-            with open(image, 'rb') as src:
+            with MappedImage(image) as src:
                 written = 0
-                for chunk in iter(lambda: src.read(CHUNK), b''):
+                for chunk in src.chunks():
                     writer_proc.stdin.write(chunk)
                     written += len(chunk)
                     gauge.update(min(written * 100 // image_size, 99))
+                    sampler.sample(written)
         except (OSError, BrokenPipeError):
             write_ok = False
         try:
@@ -826,6 +1199,10 @@ def flash_image(state):
             pass
 
     gauge.close()
+    state['flash_seconds'] = sampler.elapsed
+    if write_ok:
+        sampler.sample(image_size, force=True)
+    state['flash_samples'] = sampler.samples
 
     if not write_ok:
         remove_unpacked_image(state)
@@ -839,9 +1216,10 @@ def flash_image(state):
 
 
 def verify_flash(state):
-    """Step 4a: compare SHA-256 of the source image vs. the first image_size
-    bytes read back from the device. Sets state['verify_result'] to 0 or 1.
-    Uses Python's hashlib — no external sha256sum needed.
+    """Step 4a: compare the digest of the source image vs. the first
+    image_size bytes read back from the device. Sets state['verify_result']
+    to 0 or 1. The algorithm is state['digest_algorithm'] (see DIGESTS);
+    device data is hashed on its own thread so reads and hashing overlap.
     """
     if not obtain_sudo():
         state['verify_result'] = 1
@@ -853,33 +1231,36 @@ def verify_flash(state):
     disk = state['selected_disk']
     out_dev = raw_device(disk)
     image_size = Path(image).stat().st_size
+    algorithm = state['digest_algorithm']
 
     gauge = Gauge(
         'Step 4 of 4 — Verifying',
         f'Verifying {Path(image).name} against {disk}\n\n'
         'Do not remove the disk or power off the computer.',
     )
+    started = time.monotonic()
 
-    # Hash the source image in a background thread while reading the device.
-    img_hash = [None]
+    # Hash the source image in a background thread while reading the device,
+    # unless `--index` already left a digest for it.
+    img_hash = [load_sidecar_digest(state['selected_image'], algorithm)]
     hash_error = [None]
 
     def _hash_source():
         try:
-            h = hashlib.sha256()
-            with open(image, 'rb') as f:
-                for chunk in iter(lambda: f.read(4 * 1024 * 1024), b''):
+            h = DIGESTS[algorithm]()
+            with MappedImage(image) as src:
+                for chunk in src.chunks():
                     h.update(chunk)
             img_hash[0] = h.hexdigest()
         except OSError as exc:
             hash_error[0] = str(exc)
 
     src_thread = threading.Thread(target=_hash_source, daemon=True)
-    src_thread.start()
+    if img_hash[0] is None:
+        src_thread.start()
 
     # Hash the first image_size bytes read back from the device.
-    CHUNK = 4 * 1024 * 1024
-    h = hashlib.sha256()
+    h = ThreadedDigest(DIGESTS[algorithm]())
     remaining = image_size
     read_ok = True
 
@@ -888,14 +1269,14 @@ def verify_flash(state):
         try:
             with open(out_dev, 'rb') as dev:
                 while remaining > 0:
-                    chunk = dev.read(min(CHUNK, remaining))
+                    chunk = dev.read(min(CHUNK_SIZE, remaining))
                     if not chunk:
                         read_ok = False
                         break
                     h.update(chunk)
                     remaining -= len(chunk)
                     gauge.update(min((image_size - remaining) * 100 // image_size, 99))
-        except OSError as exc:
+        except Exception as exc:   # a read error, or the digest failed
             read_ok = False
             state['verify_details'] = str(exc)
     else:
@@ -918,14 +1299,14 @@ def verify_flash(state):
         )
         try:
             while remaining > 0:
-                chunk = reader_proc.stdout.read(min(CHUNK, remaining))
+                chunk = reader_proc.stdout.read(min(CHUNK_SIZE, remaining))
                 if not chunk:
                     read_ok = False
                     break
                 h.update(chunk)
                 remaining -= len(chunk)
                 gauge.update(min((image_size - remaining) * 100 // image_size, 99))
-        except (OSError, BrokenPipeError) as exc:
+        except Exception as exc:   # a read error, or the digest failed
             read_ok = False
             state['verify_details'] = str(exc)
         reader_proc.stdout.close()   # closing pipe sends SIGPIPE to reader
@@ -938,23 +1319,34 @@ def verify_flash(state):
                 f'{stderr or "no error output"}'
             )
     try:
-        src_thread.join()
+        try:
+            device_hash = h.hexdigest()
+        except Exception as exc:
+            device_hash = None
+            if read_ok:
+                read_ok = False
+                state['verify_details'] = f'Could not hash the disk data: {exc}'
+        if src_thread.is_alive():
+            src_thread.join()
         if hash_error[0]:
             state['verify_details'] = f'Could not hash source image: {hash_error[0]}'
         elif not read_ok:
             state['verify_details'] = state.get(
                 'verify_details', 'Could not read the selected disk.',
             )
-        elif h.hexdigest() != img_hash[0]:
+        elif device_hash != img_hash[0]:
             state['verify_details'] = 'Data read from the disk differs from the source image.'
         else:
             state['verify_details'] = ''
-        match = read_ok and not hash_error[0] and h.hexdigest() == img_hash[0]
+        match = read_ok and not hash_error[0] and device_hash == img_hash[0]
         state['verify_result'] = 0 if match else 1
+        state['verify_seconds'] = time.monotonic() - started
+        if img_hash[0]:
+            state['image_digest'] = f'{algorithm}:{img_hash[0]}'
         if not match:
             state['verify_log'] = write_verification_log(
                 image, out_dev, image_size, image_size - remaining,
-                img_hash[0], h.hexdigest(), state['verify_details'],
+                img_hash[0], device_hash or 'unavailable', state['verify_details'], algorithm,
             )
     finally:
         gauge.close()
@@ -986,10 +1378,206 @@ def show_result(state):
             f'Image:\n{img}\n\nTarget:\n{disk}\n\n'
             'The operating system may now detect new partitions on the target disk.'
         )
+    if state.get('history_warning'):
+        body += f'\n\nWarning: {state["history_warning"]}'
 
     return dlg_yesno(title, body, yes='Restart', no='Exit') == OK
 
 
+# ── Flash history ─────────────────────────────────────────────────────────────
+# Every flash attempt is kept in a local SQLite database so slow or failing
+# card batches and hub ports show up over time.
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flashes (
+    id              INTEGER PRIMARY KEY,
+    started         TEXT NOT NULL,
+    image           TEXT NOT NULL,
+    image_digest    TEXT,       -- '<algorithm>:<hex>', NULL if not verified
+    image_bytes     INTEGER,
+    device          TEXT,
+    model           TEXT,
+    serial          TEXT,
+    port            TEXT,
+    flash_result    INTEGER,
+    flash_seconds   REAL,
+    throughput      TEXT,       -- JSON list of [seconds, bytes_written]
+    verify_result   INTEGER,    -- NULL if verification did not run
+    verify_seconds  REAL
+)
+"""
+SLOW_FLASH_RATIO = 0.75   # warn below this fraction of the model's average
+HISTORY_MIN_SAMPLES = 3   # prior successful flashes needed before warning
+HISTORY_RECENT = 3        # latest flashes of a model compared with the earlier
+
+
+def default_history_db():
+    data_home = os.environ.get('XDG_DATA_HOME') or \
+        str(Path.home() / '.local' / 'share')
+    return str(Path(data_home) / 'image-flasher' / 'history.sqlite3')
+
+
+def open_history(path):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute(HISTORY_SCHEMA)
+    return db
+
+
+class ThroughputSampler:
+    """Collect (elapsed seconds, bytes done) pairs at most once per interval."""
+    def __init__(self, interval=1.0):
+        self._start = time.monotonic()
+        self._next = 0.0
+        self._interval = interval
+        self.samples = []
+
+    def sample(self, done, force=False):
+        elapsed = time.monotonic() - self._start
+        if force or elapsed >= self._next:
+            self.samples.append([round(elapsed, 2), done])
+            self._next = elapsed + self._interval
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+
+def _rate(nbytes, seconds):
+    return nbytes / seconds if seconds else 0.0
+
+
+def _model_rates(db, model):
+    """Write rates of the latest successful flashes of model, newest first."""
+    # cards of unknown model have nothing in common to compare
+    if not model:
+        return []
+    return [_rate(nbytes, seconds) for nbytes, seconds in db.execute(
+        'SELECT image_bytes, flash_seconds FROM flashes '
+        'WHERE model = ? AND flash_result = 0 AND flash_seconds > 0 '
+        'ORDER BY id DESC LIMIT 20', (model,),
+    )]
+
+
+def model_speed_warning(db_path, model):
+    """Return a warning when the latest flashes of a card model wrote
+    noticeably slower than the earlier ones, else ''. Shown before a card of
+    that model is flashed; a missing or unreadable history gives ''.
+    """
+    if not model or not Path(db_path).is_file():
+        return ''
+    try:
+        db = sqlite3.connect(db_path)
+        try:
+            rates = _model_rates(db, model)
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return ''
+    recent, earlier = rates[:HISTORY_RECENT], rates[HISTORY_RECENT:]
+    if len(recent) < HISTORY_RECENT or len(earlier) < HISTORY_MIN_SAMPLES:
+        return ''
+    now = sum(recent) / len(recent)
+    before = sum(earlier) / len(earlier)
+    if now >= before * SLOW_FLASH_RATIO:
+        return ''
+    return (
+        f'The last {len(recent)} flashes of {model} wrote at '
+        f'{format_size(now)}/s, down from {format_size(before)}/s over the '
+        f'{len(earlier)} before. Cards of this model may be wearing out or '
+        'come from a slower batch.'
+    )
+
+
+def record_flash(state, db_path):
+    """Store the finished flash in the history database.
+    Sets state['history_warning'] when the card wrote noticeably slower than
+    earlier flashes of the same model. Database errors never fail a flash.
+    """
+    state['history_warning'] = ''
+    if not state.get('flash_started'):
+        return
+    model, serial, port = disk_identity(state['selected_disk'])
+    verified = state['flash_result'] == 0
+    try:
+        db = open_history(db_path)
+    except (OSError, sqlite3.Error):
+        return
+    try:
+        with db:
+            previous = _model_rates(db, model)
+            db.execute(
+                'INSERT INTO flashes (started, image, image_digest, image_bytes, '
+                'device, model, serial, port, flash_result, flash_seconds, '
+                'throughput, verify_result, verify_seconds) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (state['flash_started'], state['selected_image'],
+                 state.get('image_digest') or None, state.get('image_bytes'),
+                 state['selected_disk'], model, serial, port,
+                 state['flash_result'], state.get('flash_seconds'),
+                 json.dumps(state.get('flash_samples', [])),
+                 state['verify_result'] if verified else None,
+                 state.get('verify_seconds') if verified else None),
+            )
+    except sqlite3.Error:
+        return
+    finally:
+        db.close()
+
+    rate = _rate(state.get('image_bytes') or 0, state.get('flash_seconds'))
+    if state['flash_result'] or len(previous) < HISTORY_MIN_SAMPLES or not rate:
+        return
+    average = sum(previous) / len(previous)
+    if rate < average * SLOW_FLASH_RATIO:
+        state['history_warning'] = (
+            f'This {model or "card"} wrote at {format_size(rate)}/s, below its '
+            f'average of {format_size(average)}/s over {len(previous)} earlier '
+            'flashes. The card may be worn or the port may be slow.'
+        )
+
+
+def show_history(db_path, limit=20):
+    """Print recent flashes and per-model statistics to stdout."""
+    if not Path(db_path).is_file():
+        print(f'No flash history recorded yet ({db_path}).')
+        return
+    db = open_history(db_path)
+    try:
+        rows = db.execute(
+            'SELECT started, image, model, serial, port, image_bytes, '
+            'flash_seconds, flash_result, verify_result '
+            'FROM flashes ORDER BY id DESC LIMIT ?', (limit,),
+        ).fetchall()
+        print(f'Last {len(rows)} flashes ({db_path})')
+        for started, image, model, serial, port, nbytes, secs, fr, vr in rows:
+            outcome = 'FAILED' if fr else ('VERIFY FAILED' if vr else 'ok')
+            print(f'  {started[:19]}  {Path(image).name}  '
+                  f'{model or "Unknown"} {serial or "-"} @ {port or "-"}  '
+                  f'{format_size(_rate(nbytes or 0, secs))}/s  {outcome}')
+
+        print('\nPer model')
+        for model, count, failed, bad_verify, nbytes, secs in db.execute(
+            'SELECT model, COUNT(*), SUM(flash_result != 0), '
+            'SUM(COALESCE(verify_result, 0) != 0), '
+            'SUM(CASE WHEN flash_result = 0 THEN image_bytes END), '
+            'SUM(CASE WHEN flash_result = 0 THEN flash_seconds END) '
+            'FROM flashes GROUP BY model ORDER BY COUNT(*) DESC',
+        ):
+            print(f'  {model or "Unknown"}: {count} flashes, {failed} failed, '
+                  f'{bad_verify} failed verification, '
+                  f'average {format_size(_rate(nbytes or 0, secs))}/s')
+
+        print('\nPer port')
+        for port, count, failed in db.execute(
+            'SELECT port, COUNT(*), '
+            'SUM(flash_result != 0 OR COALESCE(verify_result, 0) != 0) '
+            'FROM flashes GROUP BY port ORDER BY COUNT(*) DESC',
+        ):
+            print(f'  {port or "unknown"}: {count} flashes, {failed} failed')
+    finally:
+        db.close()
+
+
 # ── Entry point ───────────────────────────────────────────────────────────────
 
 def main():
@@ -1002,14 +1590,52 @@ def main():
         help='Directory containing raw disk images '
              '(default: images/ beside this script)',
     )
+    parser.add_argument(
+        '--digest',
+        choices=sorted(DIGESTS),
+        default=DEFAULT_DIGEST,
+        help='Digest used to verify the written image (default: %(default)s; '
+             'blake3, xxh3/xxh128 and crc32c need their optional modules)',
+    )
+    parser.add_argument(
+        '--index',
+        action='store_true',
+        help='Hash every image in the images directory in parallel, write '
+             '.blocks.json sidecars (and .sha256 for uncompressed images), '
+             'then exit',
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        metavar='N',
+        help='Worker processes for --index (default: one per CPU)',
+    )
+    parser.add_argument(
+        '--history',
+        action='store_true',
+        help='Print recent flashes and per-model/port statistics, then exit',
+    )
+    parser.add_argument(
+        '--history-db',
+        metavar='FILE',
+        default=default_history_db(),
+        help='SQLite flash history database (default: %(default)s)',
+    )
     args = parser.parse_args()
 
+    if args.history:
+        show_history(args.history_db)
+        return
+
     script_dir = Path(__file__).resolve().parent
     images_dir = args.images_dir or str(script_dir / 'images')
 
     if not Path(images_dir).is_dir():
         sys.exit(f'Error: images directory does not exist: {images_dir}')
 
+    if args.index:
+        sys.exit(1 if index_images(images_dir, args.digest, args.jobs) else 0)
+
     check_dependencies()
 
     global _temp_dir
@@ -1026,6 +1652,11 @@ def main():
         # results
         'flash_result': 0, 'flash_details': '',
         'verify_result': 0, 'verify_details': '', 'verify_log': '',
+        'digest_algorithm': args.digest,
+        # history
+        'flash_started': '', 'image_digest': '', 'image_bytes': 0,
+        'flash_samples': [], 'flash_seconds': None, 'verify_seconds': None,
+        'history_warning': '', 'history_db': args.history_db,
     }
 
     step = 1
@@ -1042,6 +1673,7 @@ def main():
         elif step == 4:
             if state['flash_result'] == 0:
                 verify_flash(state)
+            record_flash(state, args.history_db)
             if not show_result(state):
                 break
             step = 1
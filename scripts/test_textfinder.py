@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+
+import io
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+from textfinder import PREVIEW_RECORDS, PRINT_CHUNK_LINES, Printer, Textfinder, combine_patterns
+
+
+class SearchStringTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+    def test_empty_match_inside_multibyte_character(self):
+        # a zero width match may fall between the bytes of the é
+        path = self.write('f.txt', 'café ok\n'.encode('utf-8'))
+        for regex in ('x?', 'b*', '(ok)?'):
+            finder = Textfinder('*', regex, jobs=1)
+            matches = finder.search_string(path)
+            self.assertEqual([m.line for m in matches], ['café ok\n'])
+            self.assertEqual(matches[0].spans, [m.span() for m in finder.prog.finditer('café ok\n')])
+
+
+    def test_reused_buffer_ends_at_the_file(self):
+        # the tail of a longer file read before must not be searched again
+        long = self.write('long.txt', b'one\n' * 100 + b'needle\n')
+        short = self.write('short.txt', b'two\n')
+        finder = Textfinder('*', 'needle|two', jobs=1)
+        self.assertEqual([m.lineno for m in finder.search_string(long)], [101])
+        self.assertEqual([m.line for m in finder.search_string(short)], ['two\n'])
+
+
+class CombinePatternsTest(unittest.TestCase):
+
+    def test_group_name_used_by_several_patterns(self):
+        patterns = ['(?P<x>foo)(?P=x)', '(?P<x>bar)(?(x)!)']
+        regex, groups, _ = combine_patterns(patterns)
+        prog = re.compile(regex)
+        for text, pattern in (('foofoo', patterns[0]), ('bar!', patterns[1])):
+            m = prog.fullmatch(text)
+            self.assertIsNotNone(m)
+            self.assertEqual(groups[m.lastgroup], pattern)
+
+
+class PrinterTest(unittest.TestCase):
+
+    def test_matches_of_a_file_are_written_in_chunks(self):
+        writes = []
+        stream = io.StringIO()
+        stream.write = writes.append
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'a.log'), 'w') as f:
+                f.write('hit\n' * (2 * PRINT_CHUNK_LINES))
+            finder = Textfinder('*', 'hit', jobs=1, printer=Printer('vimgrep', stream=stream))
+            finder.textfinder(tmp)
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(''.join(writes).count('\n'), 2 * PRINT_CHUNK_LINES)
+        self.assertEqual(finder.num_matches_strings, 2 * PRINT_CHUNK_LINES)
+
+
+class ReplaceTest(unittest.TestCase):
+
+    def test_interactive_replace_with_empty_string(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a.txt')
+            with open(path, 'w') as f:
+                f.write('keep foo here\nfoo\n')
+            with open(os.devnull, 'w') as devnull:
+                finder = Textfinder('*', 'foo', replacement='', jobs=1,
+                                    printer=Printer(color=False, stream=devnull))
+                with mock.patch('builtins.input', return_value='y'):
+                    finder.textfinder(tmp)
+            with open(path) as f:
+                self.assertEqual(f.read(), 'keep  here\n\n')
+            self.assertEqual(finder.num_replaces, 2)
+
+
+    def test_previews_of_many_lines_are_spooled(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a.txt')
+            with open(path, 'w') as f:
+                f.write('foo\n' * PREVIEW_RECORDS)
+            finder = Textfinder('*', 'foo', replacement='bar', dry_run=True, jobs=1)
+            previews, edit = finder.plan_replace(path)
+            self.assertIsNone(edit)
+            self.assertEqual(len(previews.records), PREVIEW_RECORDS)
+            lines = [m.line for m in previews]
+            self.assertEqual(lines, ['foo\n', 'bar\n'] * PREVIEW_RECORDS)
+            spool = previews.spool
+            previews.discard()
+            self.assertFalse(os.path.exists(spool))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,43 @@ import fnmatch
 import sys
 import re
 import argparse
+import bisect
+import bz2
+import codecs
+import contextlib
+import datetime
+import errno
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import lzma
+import marshal
+import mmap
+import select
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import groupby
+from operator import attrgetter
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+try:
+    import ctypes
+except ModuleNotFoundError:
+    ctypes = None
 
 try:
     from versioning import version_string
@@ -13,23 +50,1466 @@ except ModuleNotFoundError:
         return "Unknown version"
 
 
-class Colors:
+class Colors:
+    """
+    Pretty colors for output.
+    """
+    HEADER = '\033[95m'
+    OKBLUE = '\033[94m'
+    OKGREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+
+
+class NoColors(Colors):
+    """
+    Colors for output that does not go to a terminal.
+    """
+    HEADER = OKBLUE = OKGREEN = WARNING = FAIL = ENDC = ''
+
+
+def _parse(regex):
+    """
+    Returns the parse tree of regex from the re module's own parser.
+    """
+    return sre_parse.parse(regex)
+
+
+def _nodes(parsed):
+    """
+    Yields every (opcode name, argument) pair in a parse tree, depth first,
+    including the items of character sets.
+    """
+    for op, av in parsed:
+        yield op.name, av
+        if op.name == 'IN':
+            for item_op, item_av in av:
+                yield item_op.name, item_av
+            continue
+        for arg in av if isinstance(av, (tuple, list)) else (av,):
+            if isinstance(arg, sre_parse.SubPattern):
+                yield from _nodes(arg)
+            elif isinstance(arg, list):
+                for item in arg:
+                    yield from _nodes(item)
+
+
+def _flags(parsed):
+    state = getattr(parsed, 'state', None) or getattr(parsed, 'pattern', None)
+    return state.flags
+
+
+def bytes_safe(regex):
+    """
+    Tells whether regex finds the same lines when compiled as a bytes pattern
+    and run over UTF-8 encoded text. That holds when it only matches ASCII
+    literals and sets, since UTF-8 never uses ASCII byte values inside
+    multibyte characters. Anything that matches "any" character, Unicode
+    categories, word boundaries, string anchors or case folding can differ.
+    """
+    try:
+        regex.encode('ascii')
+        parsed = _parse(regex)
+    except (UnicodeEncodeError, re.error):
+        return False
+    if _flags(parsed) & re.IGNORECASE:
+        return False
+    for op, av in _nodes(parsed):
+        if op in ('ANY', 'NOT_LITERAL', 'NEGATE', 'CATEGORY'):
+            return False
+        if op == 'LITERAL' and av > 127 or op == 'RANGE' and av[1] > 127:
+            return False
+        if op == 'AT' and av.name in ('AT_BEGINNING_STRING', 'AT_END_STRING',
+                                      'AT_BOUNDARY', 'AT_NON_BOUNDARY'):
+            return False
+        if op == 'SUBPATTERN' and av[1] & re.IGNORECASE:
+            return False
+    return True
+
+
+def _anchors_line_end(regex):
+    return any(op == 'AT' and av.name in ('AT_END', 'AT_END_LINE')
+               for op, av in _nodes(_parse(regex)))
+
+
+def _matches_empty(regex):
+    return _parse(regex).getwidth()[0] == 0
+
+
+def _spans_lines(regex):
+    return any(op == 'LITERAL' and av == 10 or
+               op == 'RANGE' and av[0] <= 10 <= av[1]
+               for op, av in _nodes(_parse(regex)))
+
+
+def required_literals(regex):
+    """
+    Returns a list of byte strings of which every match of regex contains at
+    least one, or None if the pattern has no such literals. Line breaks are
+    never part of a literal, so universal newlines can not hide one.
+    """
+    try:
+        parsed = _parse(regex)
+        if _flags(parsed) & re.IGNORECASE:
+            return None
+        literals = _required(parsed)
+        if not literals:
+            return None
+        return list(dict.fromkeys(data for l in literals for data in _encoded(l)))
+    except (re.error, UnicodeEncodeError):
+        return None
+
+
+def _encoded(text):
+    """
+    Returns the byte strings text can appear as in a file: UTF-8, and for
+    non-ASCII text latin-1, which lines that are not UTF-8 are read as.
+    """
+    variants = [text.encode('utf-8')]
+    if not text.isascii():
+        try:
+            variants.append(text.encode('latin-1'))
+        except UnicodeEncodeError:
+            pass
+    return variants
+
+
+def _required(parsed):
+    """
+    Collects candidate literal sets along a sequence of the parse tree and
+    returns the most selective one: the longest shortest literal, then the
+    fewest alternatives.
+    """
+    candidates = []
+    run = []
+    for op, av in parsed:
+        op = op.name
+        if op == 'LITERAL' and av not in (10, 13):
+            run.append(chr(av))
+            continue
+        if run:
+            candidates.append([''.join(run)])
+            run = []
+
+        found = None
+        if op == 'SUBPATTERN' and not av[1] & re.IGNORECASE:
+            found = _required(av[-1])
+        elif op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT') and av[0] >= 1:
+            found = _required(av[2])
+        elif op == 'ATOMIC_GROUP':
+            found = _required(av)
+        elif op == 'BRANCH':
+            alternatives = [_required(p) for p in av[1]]
+            if all(alternatives):
+                found = sorted(set(sum(alternatives, [])))
+        if found:
+            candidates.append(found)
+    if run:
+        candidates.append([''.join(run)])
+    return max(candidates, default=None,
+               key=lambda c: (min(len(l) for l in c), -len(c)))
+
+
+def _literal(regex):
+    """
+    Returns the text regex matches if it is a plain literal, else None.
+    """
+    try:
+        parsed = _parse(regex)
+    except re.error:
+        return None
+    if _flags(parsed) & re.IGNORECASE:
+        return None
+    if all(op.name == 'LITERAL' for op, av in parsed):
+        return ''.join(chr(av) for op, av in parsed)
+    return None
+
+
+def trie_regex(words):
+    """
+    Returns a regex matching any of words, with common prefixes merged the
+    way a trie does, e.g. foo(?:bar|d)?. The re module tries the branches
+    of a flat alternation one after the other at every position, a trie
+    shaped one is decided a character at a time.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+    return _trie_node(trie)
+
+
+def _trie_node(node):
+    branches = [re.escape(char) + _trie_node(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    if len(branches) > 1:
+        body = '(?:%s)' % '|'.join(branches)
+        return body + '?' if '' in node else body
+    return '(?:%s)?' % branches[0] if '' in node else branches[0]
+
+
+# Inline flags at the start of a pattern, they only apply to a whole regex.
+_GLOBAL_FLAGS = re.compile(r'\(\?([aiLmsux]+)\)')
+
+
+# A backreference or a group condition by number, and a character class, in
+# which digits after a backslash are an octal escape.
+_GROUP_NUMBER = re.compile(r'\\([1-9][0-9]?)|\(\?\(([1-9][0-9]?)\)|'
+                           r'\(\?P<(\w+)>|\(\?P=(\w+)\)|\(\?\((\w+)\)|'
+                           r'\[\^?\]?(?:\\.|[^\]])*\]|\\.', re.S)
+
+
+def _shift_groups(pattern, shift, names=None):
+    """
+    Renumbers the backreferences and group conditions of pattern for shift
+    groups in front of it, and renames the named groups in names, a dict
+    from old to new names, along with their references. Three octal digits
+    after a backslash are an escape, not a reference, and are left alone.
+    """
+    def renumber(m):
+        for group in (3, 4, 5):
+            name = m.group(group)
+            if name is not None:
+                start, end = m.start(group) - m.start(), m.end(group) - m.start()
+                return m.group()[:start] + (names or {}).get(name, name) + m.group()[end:]
+        number = m.group(1) or m.group(2)
+        if number is None or m.group(1) and re.match(r'[0-7]{3}', pattern[m.start() + 1:m.start() + 4]):
+            return m.group()
+        number = int(number) + shift
+        if number > 99:
+            raise re.error('too many groups to renumber the reference %s' % (m.group(),))
+        return '\\%d' % (number,) if m.group(1) else '(?(%d)' % (number,)
+    return _GROUP_NUMBER.sub(renumber, pattern)
+
+
+# The combined regex of several patterns names the group of every pattern
+# that is not a literal, all literals share one trie shaped group.
+PATTERN_GROUP = '_p%d'
+LITERALS_GROUP = '_literals'
+
+
+def combine_patterns(patterns, fixed=False):
+    """
+    Joins several patterns into one regex that matches any of them in one
+    scan. Returns the regex, a dict from group names to the patterns, and
+    a dict from literal texts to the patterns that are literals. With fixed
+    every pattern is a literal. Inline flags of a pattern are scoped to
+    its group. Numbered backreferences in the patterns shift by the groups
+    in front of them, and a group name used by an earlier pattern, or by
+    the combined regex itself, is renamed after the pattern.
+    """
+    groups = {}
+    literals = {}
+    branches = []
+    shift = 0
+    used = {PATTERN_GROUP % i for i in range(len(patterns))} | {LITERALS_GROUP}
+    for i, pattern in enumerate(patterns):
+        text = pattern if fixed else _literal(pattern)
+        if text is not None:
+            literals.setdefault(text, pattern)
+        else:
+            groups[PATTERN_GROUP % i] = pattern
+            # the named group of the pattern comes before its own groups
+            shift += 1
+            prog = re.compile(pattern)
+            names = {}
+            for name in prog.groupindex:
+                if name in used:
+                    names[name] = '%s_%s' % (PATTERN_GROUP % i, name)
+                used.add(names.get(name, name))
+            pattern = _shift_groups(pattern, shift, names)
+            shift += prog.groups
+            flags = _GLOBAL_FLAGS.match(pattern)
+            if flags:
+                pattern = '(?%s:%s)' % (flags.group(1), pattern[flags.end():])
+            branches.append('(?P<%s>%s)' % (PATTERN_GROUP % i, pattern))
+    if literals:
+        branches.append('(?P<%s>%s)' % (LITERALS_GROUP, trie_regex(literals)))
+    return '|'.join(branches), groups, literals
+
+
+# A trigram query is a list of alternatives, each a set of trigrams that
+# must all occur in a file. An empty set matches every file. Cross products
+# of alternations are capped, beyond that a group adds no constraint.
+MAX_QUERY_ALTERNATIVES = 64
+
+
+def _trigrams(data):
+    return frozenset(data[i:i + 3] for i in range(len(data) - 2))
+
+
+def trigram_query(regex):
+    """
+    Plans which trigrams a file must contain to possibly match regex.
+    """
+    try:
+        parsed = _parse(regex)
+        if _flags(parsed) & re.IGNORECASE:
+            return [frozenset()]
+        return _query(parsed)
+    except (re.error, UnicodeEncodeError):
+        return [frozenset()]
+
+
+def _query(parsed):
+    clauses = [frozenset()]
+    run = []
+    for op, av in list(parsed) + [(None, None)]:
+        name = op.name if op else None
+        if name == 'LITERAL' and av not in (10, 13):
+            run.append(chr(av))
+            continue
+        if run:
+            variants = [_trigrams(data) for data in _encoded(''.join(run))]
+            if len(clauses) * len(variants) <= MAX_QUERY_ALTERNATIVES:
+                clauses = [c | grams for c in clauses for grams in variants]
+            run = []
+
+        sub = None
+        if name == 'SUBPATTERN' and not av[1] & re.IGNORECASE:
+            sub = _query(av[-1])
+        elif name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT') and av[0] >= 1:
+            sub = _query(av[2])
+        elif name == 'ATOMIC_GROUP':
+            sub = _query(av)
+        elif name == 'BRANCH':
+            alternatives = [_query(p) for p in av[1]]
+            sub = [c for a in alternatives for c in a]
+        if sub and all(sub) and len(clauses) * len(sub) <= MAX_QUERY_ALTERNATIVES:
+            clauses = [c | d for c in clauses for d in sub]
+    return clauses
+
+
+# Files larger than this are not indexed, they are searched on every query.
+INDEX_MAX_FILESIZE = 64 << 20
+
+
+def file_trigrams(path):
+    """
+    Returns (path, mtime_ns, size, trigrams) for the index. Trigrams are the
+    sorted distinct 3 byte sequences of the file joined together, or None if
+    the file is not indexed and must always be searched.
+    """
+    try:
+        st = os.stat(path)
+        if st.st_size > INDEX_MAX_FILESIZE:
+            return path, st.st_mtime_ns, st.st_size, None
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return path, 0, -1, None
+    encoding = detect_encoding(data[:BINARY_PROBE_SIZE])
+    if encoding in WIDE_ENCODINGS:
+        # searched as UTF-8, so index it as such
+        data = data.decode(encoding, 'replace').lstrip('\ufeff').encode('utf-8')
+    grams = {data[i:i + 3] for i in range(len(data) - 2)}
+    return path, st.st_mtime_ns, st.st_size, b''.join(sorted(grams))
+
+
+def default_index_file(directory):
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    key = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+    return os.path.join(cache, 'textfinder', key[:16] + '.idx')
+
+
+class TrigramIndex:
+    """
+    Persistent trigram index of searched files. Files are numbered, every
+    trigram keeps a posting list of the ids of files containing it, and a
+    file that changed by mtime or size gets a new id while the old one turns
+    into a tombstone. The file is a zlib compressed marshal dump with the
+    posting lists stored as packed 32 bit integers.
+    """
+    MAGIC = b'textfinder-trigrams 1\n'
+
+    def __init__(self, path):
+        self.path = path
+        self.files = []      # id -> [path, mtime_ns, size, indexed] or None
+        self.ids = {}        # path -> id
+        self.postings = {}   # trigram -> array of ids, ascending
+        self.unindexed = set()
+        self.dirty = False
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads the index at path, an unreadable index starts out empty.
+        """
+        index = cls(path)
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                    return index
+                files, postings = marshal.loads(zlib.decompress(f.read()))
+        except (OSError, ValueError, EOFError, zlib.error):
+            return index
+        index.files = files
+        for i, entry in enumerate(files):
+            if entry is not None:
+                index.ids[entry[0]] = i
+                if not entry[3]:
+                    index.unindexed.add(i)
+        for gram, ids in postings.items():
+            index.postings[gram] = array('I', ids)
+        return index
+
+
+    def save(self):
+        if not self.dirty:
+            return
+        if len(self.ids) * 2 < len(self.files):
+            self._compact()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        postings = {gram: ids.tobytes() for gram, ids in self.postings.items()}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(zlib.compress(marshal.dumps((self.files, postings)), 1))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+    def _compact(self):
+        """
+        Renumbers the live files, dropping tombstones from posting lists.
+        """
+        remap = {}
+        files = []
+        for i, entry in enumerate(self.files):
+            if entry is not None:
+                remap[i] = len(files)
+                files.append(entry)
+        for gram, ids in list(self.postings.items()):
+            live = array('I', (remap[i] for i in ids if i in remap))
+            if live:
+                self.postings[gram] = live
+            else:
+                del self.postings[gram]
+        self.files = files
+        self.ids = {entry[0]: i for i, entry in enumerate(files)}
+        self.unindexed = {remap[i] for i in self.unindexed if i in remap}
+
+
+    def stale(self, path):
+        """
+        Tells whether path is missing from the index or changed since.
+        """
+        i = self.ids.get(path)
+        if i is None:
+            return True
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        entry = self.files[i]
+        return entry[1] != st.st_mtime_ns or entry[2] != st.st_size
+
+
+    def add(self, path, mtime_ns, size, grams):
+        self.remove(path)
+        i = len(self.files)
+        self.files.append([path, mtime_ns, size, grams is not None])
+        self.ids[path] = i
+        if grams is None:
+            self.unindexed.add(i)
+        else:
+            for k in range(0, len(grams), 3):
+                self.postings.setdefault(grams[k:k + 3], array('I')).append(i)
+        self.dirty = True
+
+
+    def remove(self, path):
+        i = self.ids.pop(path, None)
+        if i is not None:
+            self.files[i] = None
+            self.unindexed.discard(i)
+            self.dirty = True
+
+
+    def candidates(self, query):
+        """
+        Returns the set of paths that may match query, or None for all.
+        """
+        if not all(query):
+            return None
+        found = set(self.unindexed)
+        for clause in query:
+            lists = sorted((self.postings.get(g, ()) for g in clause), key=len)
+            ids = set(lists[0])
+            for other in lists[1:]:
+                if not ids:
+                    break
+                ids.intersection_update(other)
+            found |= ids
+        return {self.files[i][0] for i in found if self.files[i] is not None}
+
+
+# Bytes looked at to tell binary files from text: a NUL byte in there means
+# binary, as with grep and git.
+BINARY_PROBE_SIZE = 8192
+
+# Byte order marks, the UTF-32 LE one before the UTF-16 LE one it starts
+# with. Files in the wide encodings are searched transcoded to UTF-8.
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+WIDE_ENCODINGS = ('utf-32-le', 'utf-32-be', 'utf-16-le', 'utf-16-be')
+
+
+def detect_encoding(head):
+    """
+    Tells the encoding of a file from its first bytes, by its byte order
+    mark, or as UTF-16 without one when nearly every byte at odd or at even
+    offsets is NUL, like in mostly ASCII text from Windows tools. Returns
+    None for a file read line by line as UTF-8, or latin-1 where a line is
+    not UTF-8.
+    """
+    if head[:1] in (b'\xef', b'\xfe', b'\xff', b'\0'):
+        for bom, encoding in BOMS:
+            if head.startswith(bom):
+                return encoding
+    if len(head) >= 16 and b'\0' in head:
+        even = head[0::2].count(0) / len(head[0::2])
+        odd = head[1::2].count(0) / len(head[1::2])
+        if odd > 0.7 and even < 0.1:
+            return 'utf-16-le'
+        if even > 0.7 and odd < 0.1:
+            return 'utf-16-be'
+    return None
+
+
+# Bytes of whole lines decoded and searched at once in line mode.
+LINE_BLOCK_SIZE = 1 << 20
+
+# Files smaller than this are read whole into a buffer reused from file to
+# file, larger ones are mapped. Reading a mapping of a file truncated
+# meanwhile kills the process with SIGBUS, so only large files risk it.
+MMAP_MIN_SIZE = 32 << 20
+
+
+def _blocks(f):
+    """
+    Yields the content of the binary file f in blocks of whole lines.
+    """
+    while True:
+        block = f.read(LINE_BLOCK_SIZE)
+        if not block:
+            return
+        if not block.endswith(b'\n'):
+            block += f.readline()
+        yield block
+
+
+def _transcoded(f, encoding):
+    """
+    Yields the content of the binary file f in a wide encoding as UTF-8, in
+    blocks of whole lines and without the byte order mark.
+    """
+    text = io.TextIOWrapper(f, encoding, errors='replace', newline='')
+    first = True
+    while True:
+        block = text.read(LINE_BLOCK_SIZE)
+        if not block:
+            return
+        if not block.endswith('\n'):
+            block += text.readline()
+        if first and block.startswith('\ufeff'):
+            block = block[1:]
+        first = False
+        yield block.encode('utf-8')
+
+
+def parse_size(text):
+    """
+    Parses a size like 512, 64k, 10M or 2G into bytes.
+    """
+    units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    text = text.strip().lower().rstrip('b')
+    try:
+        if text and text[-1] in units:
+            return int(float(text[:-1]) * units[text[-1]])
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: %s' % (text,))
+
+
+def parse_age(text):
+    """
+    Parses an age like 90s, 15m, 2h, 1d or 1w, or a date like 2024-05-01
+    or 2024-05-01T12:00, into the Unix time it points back to.
+    """
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+    text = text.strip()
+    try:
+        if text and text[-1].lower() in units:
+            return time.time() - float(text[:-1]) * units[text[-1].lower()]
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid age or date: %s' % (text,))
+
+
+# File name globs of the --type presets.
+FILE_TYPES = {
+    'c': ('*.c', '*.h'),
+    'c++': ('*.cpp', '*.cc', '*.cxx', '*.c++', '*.hpp', '*.hh', '*.hxx',
+            '*.h++', '*.h', '*.inl', '*.ipp', '*.tpp'),
+    'cmake': ('CMakeLists.txt', '*.cmake'),
+    'json': ('*.json',),
+    'make': ('Makefile', 'makefile', 'GNUmakefile', '*.mk', '*.mak'),
+    'markdown': ('*.md', '*.markdown'),
+    'python': ('*.py', '*.pyi', '*.pyw'),
+    'shell': ('*.sh', '*.bash', '*.zsh'),
+    'yaml': ('*.yml', '*.yaml'),
+}
+
+
+# Ignore files read in every directory, later files override earlier ones.
+IGNORE_FILES = ('.gitignore', '.ignore')
+
+
+def _gitignore_regex(pattern):
+    """
+    Translates one gitignore pattern, without its negation and trailing
+    slash, into a regex for paths relative to the ignore file's directory.
+    A pattern without an inner slash matches at any depth.
+    """
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('/**', i) and i + 3 == n:
+            out.append('/.*')
+            break
+        if c == '*':
+            while i + 1 < n and pattern[i + 1] == '*':
+                i += 1
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            chars = pattern[i + 1:end].replace('\\', '\\\\')
+            if chars[0] in '!^':
+                chars = '^' + chars[1:]
+            out.append('[%s]' % (chars,))
+            i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    body = ''.join(out)
+    return body if anchored else '(?:.*/)?' + body
+
+
+class IgnoreRules:
+    """
+    The rules of the ignore files in one directory. Each rule set is
+    compiled once into an alternation in reverse rule order, so one
+    fullmatch finds the last matching rule, which is the one that wins.
+    """
+    def __init__(self, lines, base, prefix=''):
+        # paths are matched relative to base, behind prefix
+        self._cut = len(base) if base.endswith('/') else len(base) + 1
+        self._prefix = prefix
+        self._negated = set()
+        files, dirs = [], []
+        for i, line in enumerate(lines):
+            line = line.rstrip('\n')
+            if not line.endswith('\\ '):
+                line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            name = 'r%d' % (i,)
+            if line.startswith('!'):
+                self._negated.add(name)
+                line = line[1:]
+            elif line.startswith(('\\#', '\\!')):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            group = '(?P<%s>%s)' % (name, _gitignore_regex(line.rstrip('/')))
+            dirs.append(group)
+            if not dir_only:
+                files.append(group)
+        self._files = re.compile('|'.join(reversed(files))) if files else None
+        self._dirs = re.compile('|'.join(reversed(dirs))) if dirs else None
+
+
+    @classmethod
+    def load(cls, directory, names=IGNORE_FILES, base=None, prefix=''):
+        """
+        Reads the given ignore files of directory, returns None without rules.
+        Base is the directory matched paths are relative to, if not this one.
+        """
+        lines = []
+        for name in names:
+            try:
+                with open(os.path.join(directory, name), encoding='utf-8',
+                          errors='ignore') as f:
+                    lines.extend(f)
+            except OSError:
+                pass
+        rules = cls(lines, base or directory, prefix)
+        return rules if rules._dirs else None
+
+
+    def match(self, path, is_dir):
+        """
+        Returns True if path is ignored, False if a negated rule includes it
+        again, and None if no rule matches it.
+        """
+        prog = self._dirs if is_dir else self._files
+        m = prog and prog.fullmatch(self._prefix + path[self._cut:])
+        if not m:
+            return None
+        return m.lastgroup not in self._negated
+
+
+def _parent_ignore_rules(directory):
+    """
+    Returns the ignore rules of the directories between the enclosing git
+    repository root and directory, outermost first. Nothing outside a
+    repository is read.
+    """
+    start = os.path.abspath(directory)
+    parents = []
+    current = start
+    while True:
+        parent = os.path.dirname(current)
+        if os.path.exists(os.path.join(current, '.git')):
+            break
+        if parent == current:
+            return ()
+        current = parent
+        parents.append(current)
+
+    levels = []
+    for parent in reversed(parents):
+        prefix = os.path.relpath(start, parent).replace(os.sep, '/') + '/'
+        rules = IgnoreRules.load(parent, base=directory, prefix=prefix)
+        if rules:
+            levels.append(rules)
+    return tuple(levels)
+
+
+def _compile_globs(globs):
+    return re.compile('|'.join(fnmatch.translate(g) for g in globs)) if globs else None
+
+
+class _PathEntry:
+    """
+    What the walk filters use of an os.DirEntry, for a bare path.
+    """
+    __slots__ = ('path', 'name')
+
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def _file_encoding(f):
+    """
+    Returns the encoding the binary file f is decoded with so that encoding
+    its text gives back the very same bytes, and rewinds f. The whole file
+    is checked in blocks, so it takes constant memory. Content that is not
+    UTF-8 is taken as Latin-1, which maps every byte to one character and
+    back. UTF-16 and UTF-32 text keeps its byte order mark as a character.
+    """
+    encoding = detect_encoding(f.read(BINARY_PROBE_SIZE)) or 'utf-8'
+    decoder = codecs.getincrementaldecoder(encoding)()
+    f.seek(0)
+    try:
+        while True:
+            data = f.read(LINE_BLOCK_SIZE)
+            decoder.decode(data, not data)
+            if not data:
+                break
+    except UnicodeDecodeError:
+        encoding = 'latin-1'
+    f.seek(0)
+    return encoding
+
+
+def _text_lines(f, encoding):
+    """
+    Yields the lines of the binary file f decoded with encoding, split the
+    way universal newlines split them but with their line breaks kept.
+    Only a block and the current line are held in memory.
+    """
+    yield from io.TextIOWrapper(f, encoding, newline='')
+
+
+def _stage(path, encoding, lines):
+    """
+    Writes lines, consumed as they are produced, encoded to a synced
+    temporary file beside path with the mode of path, and returns its
+    name. Renaming it over path is atomic.
+    """
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % (os.path.basename(path),),
+                               suffix='.tftmp', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding, newline='') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(path, tmp)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return tmp
+
+
+# Files handed to a worker process per task, and tasks kept in flight per
+# worker. Batching keeps the IPC cost per file small.
+BATCH_SIZE = 64
+TASKS_PER_JOB = 4
+
+_worker_finder = None
+
+
+def _init_worker(finder):
+    """
+    Pool initializer, keeps the finder configuration in the worker process.
+    """
+    global _worker_finder
+    _worker_finder = finder
+
+
+def _search_batch(paths):
+    return _worker_finder.search_batch(paths)
+
+
+def _ordered_map(pool, func, iterable, depth):
+    """
+    Like pool.map, but the iterable is consumed in the calling thread and at
+    most depth tasks are in flight. Results are yielded in submission order.
+    A worker process that dies, e.g. of SIGBUS on a mapped file truncated
+    under it, raises BrokenProcessPool here instead of leaving its task
+    pending forever.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.submit(func, item))
+        while pending and (len(pending) >= depth or pending[0].done()):
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# inotify(7) constants, the watch follows what lands in a directory.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+IN_EVENT = struct.Struct('iIII')
+
+# Seconds between two scans of the polling watcher, and how long a burst of
+# changes may continue before the changed files are searched.
+WATCH_POLL_INTERVAL = 1.0
+WATCH_SETTLE = 0.1
+
+
+class Inotify:
+    """
+    Watches directories with inotify. wait() blocks until something in a
+    watched directory changed and returns the changed paths, or None when
+    events were lost and everything has to be checked.
+    """
+    fd = -1
+
+
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self.fd = fd
+        self._dirs = {}
+        self._wds = {}
+
+
+    @classmethod
+    def create(cls):
+        """
+        Returns an Inotify instance, or None where inotify is not available.
+        """
+        if ctypes is None or not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+
+
+    def sync(self, directories):
+        """
+        Watches the directories not watched yet and forgets those that are
+        gone. Returns False when the kernel refuses more watches.
+        """
+        for directory in self._wds.keys() - directories.keys():
+            wd = self._wds.pop(directory)
+            del self._dirs[wd]
+            self._libc.inotify_rm_watch(self.fd, wd)
+        for directory in directories.keys() - self._wds.keys():
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                              IN_WATCH_MASK)
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOSPC:
+                    return False
+                continue
+            self._wds[directory] = wd
+            self._dirs[wd] = directory
+        return True
+
+
+    def wait(self):
+        paths = set()
+        timeout = None
+        while select.select([self.fd], [], [], timeout)[0]:
+            data = os.read(self.fd, 1 << 16)
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, size = IN_EVENT.unpack_from(data, pos)
+                pos += IN_EVENT.size
+                name = data[pos:pos + size].rstrip(b'\0')
+                pos += size
+                if mask & IN_Q_OVERFLOW:
+                    paths = None
+                elif paths is not None and wd in self._dirs and name:
+                    paths.add(os.path.join(self._dirs[wd], os.fsdecode(name)))
+            timeout = WATCH_SETTLE
+        return paths
+
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class Poller:
+    """
+    Watches directories by polling the modification times of the known
+    directories and files, for where inotify is not available or does not
+    see the changes, like on network file systems.
+    """
+
+
+    def __init__(self, files):
+        self._files = files
+        self._directories = {}
+        self._stamps = {}
+
+
+    def _stamp(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+
+    def sync(self, directories):
+        self._directories = directories
+        for path in list(self._stamps):
+            if path not in directories and path not in self._files:
+                del self._stamps[path]
+        for path in list(directories) + list(self._files):
+            if path not in self._stamps:
+                self._stamps[path] = self._stamp(path)
+        return True
+
+
+    def wait(self):
+        while True:
+            time.sleep(WATCH_POLL_INTERVAL)
+            paths = set()
+            for path, stamp in list(self._stamps.items()):
+                current = self._stamp(path)
+                if current == stamp:
+                    continue
+                self._stamps[path] = current
+                paths.add(path)
+                if path in self._directories:
+                    # an entry was added or removed, the new ones have no
+                    # stamp yet and the removed ones lost theirs
+                    try:
+                        with os.scandir(path) as it:
+                            paths.update(entry.path for entry in it
+                                         if entry.path not in self._stamps)
+                    except OSError:
+                        pass
+            if paths:
+                return paths
+
+
+    def close(self):
+        pass
+
+
+# Compressed files searched with --search-zip, the same stdlib codecs
+# flash-image opens images with. ZIP archives are searched member by member.
+COMPRESSION_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+DECOMPRESSION_ERRORS = (EOFError, zlib.error, lzma.LZMAError, zipfile.BadZipFile)
+
+
+def compressed(path):
+    """
+    Tells whether path is searched decompressed with --search-zip.
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    return suffix in COMPRESSION_OPENERS or suffix == '.zip'
+
+
+def _line_break(raw):
+    """
+    Turns the CRLF or CR line break of a raw line into a plain newline, the
+    way universal newlines read it.
+    """
+    if raw.endswith(b'\r\n'):
+        return raw[:-2] + b'\n'
+    if raw.endswith(b'\r'):
+        return raw[:-1] + b'\n'
+    return raw
+
+
+# A CR not followed by LF, a line break of its own with universal newlines.
+LONE_CR = re.compile(rb'\r(?!\n)')
+
+
+def _decode_line(raw):
+    """
+    Decodes a raw line as UTF-8, or as latin-1 if it is not valid UTF-8 so
+    no byte is lost. Returns the text and the encoding used.
+    """
+    try:
+        return raw.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        return raw.decode('latin-1'), 'latin-1'
+
+
+class _Block:
+    """
+    A block of whole lines, decoded at once if it is UTF-8 and else line by
+    line, taking the lines that are not UTF-8 as latin-1. locate() maps a
+    position in text back to the file.
+    """
+    __slots__ = ('text', 'base', '_ascii', '_pos', '_offset', '_starts',
+                 '_offsets', '_encodings')
+
+
+    def __init__(self, data, base):
+        self.base = base
+        self._starts = None
+        try:
+            self.text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            lines = []
+            self._starts = array('q')
+            self._offsets = array('q')
+            self._encodings = []
+            pos = 0
+            for raw in data.splitlines(True):
+                line, encoding = _decode_line(raw)
+                lines.append(line)
+                self._starts.append(pos)
+                self._offsets.append(base)
+                self._encodings.append(encoding)
+                pos += len(line)
+                base += len(raw)
+            self.text = ''.join(lines)
+        self._ascii = self._starts is None and self.text.isascii()
+        self._pos = 0
+        self._offset = self.base
+
+
+    def locate(self, pos):
+        """
+        Returns the byte offset in the file of the line starting at pos in
+        text, and the encoding it was decoded with. UTF-8 text is encoded
+        again only between two positions asked for.
+        """
+        if self._ascii:
+            return self.base + pos, 'utf-8'
+        if self._starts is not None:
+            i = bisect.bisect_right(self._starts, pos) - 1
+            return self._offsets[i], self._encodings[i]
+        if pos < self._pos:
+            self._pos, self._offset = 0, self.base
+        self._offset += len(self.text[self._pos:pos].encode('utf-8'))
+        self._pos = pos
+        return self._offset, 'utf-8'
+
+
+class Match:
+    """
+    A matched line of a file, or a line of context around one. Path is
+    archive:member for a member of a ZIP archive. Offset is the byte offset
+    of the line in the file, decompressed if it is compressed and transcoded
+    to UTF-8 if it is UTF-16 or UTF-32, or None when it is not known.
+    Encoding is the one the line was decoded with. Spans are the (start,
+    end) offsets of the matches into line, labels the pattern of every span
+    when several were searched.
+    """
+    __slots__ = ('path', 'lineno', 'offset', 'line', 'spans', 'context',
+                 'labels', 'encoding')
+
+
+    def __init__(self, path, lineno, offset, line, spans, context=False,
+                 labels=None, encoding='utf-8'):
+        self.path = path
+        self.lineno = lineno
+        self.offset = offset
+        self.line = line
+        self.spans = spans
+        self.context = context
+        self.labels = labels
+        self.encoding = encoding
+
+
+    def __repr__(self):
+        return 'Match(%r, %d, %r)' % (self.path, self.lineno, self.line)
+
+
+    @property
+    def raw(self):
+        """
+        The line as bytes, in the encoding it was decoded with and ending in
+        a plain newline.
+        """
+        return self.line.encode(self.encoding)
+
+
+    def columns(self):
+        """
+        Yields (column, byte offset, text) for every match in the line. The
+        column counts bytes from 1, the way grep and vim count them.
+        """
+        for start, end in self.spans:
+            column = len(self.line[:start].encode(self.encoding)) + 1
+            offset = None if self.offset is None else self.offset + column - 1
+            yield column, offset, self.line[start:end]
+
+
+# Preview lines of a planned replacement kept in memory, the others are
+# spooled to a temporary file until they are printed.
+PREVIEW_RECORDS = 1024
+
+
+class Previews:
+    """
+    The lines a planned replacement shows, the old and the new version of
+    every changed line. The first PREVIEW_RECORDS are kept in memory and
+    the others written to a spool file in directory, so memory stays
+    bounded however many lines change and only the spool file name is sent
+    back from a worker process. Iterating yields them as Match records.
+    """
+    __slots__ = ('path', 'directory', 'records', 'spool', '_file')
+
+
+    def __init__(self, path, directory=None):
+        self.path = path
+        self.directory = directory
+        self.records = []
+        self.spool = None
+        self._file = None
+
+
+    def __getstate__(self):
+        self.close()
+        return self.path, self.directory, self.records, self.spool
+
+
+    def __setstate__(self, state):
+        self.path, self.directory, self.records, self.spool = state
+        self._file = None
+
+
+    def append(self, lineno, line, spans):
+        if len(self.records) < PREVIEW_RECORDS:
+            self.records.append((lineno, line, spans))
+            return
+        if self._file is None:
+            fd, self.spool = tempfile.mkstemp(prefix='textfinder-', suffix='.preview',
+                                              dir=self.directory)
+            self._file = os.fdopen(fd, 'wb')
+        marshal.dump((lineno, line, spans), self._file)
+
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+    def discard(self):
+        """
+        Removes the spool file, if any.
+        """
+        self.close()
+        if self.spool is not None:
+            os.unlink(self.spool)
+            self.spool = None
+
+
+    def __iter__(self):
+        for lineno, line, spans in self.records:
+            yield Match(self.path, lineno, None, line, spans)
+        if self.spool is None:
+            return
+        self.close()
+        with open(self.spool, 'rb') as f:
+            while True:
+                try:
+                    lineno, line, spans = marshal.load(f)
+                except EOFError:
+                    return
+                yield Match(self.path, lineno, None, line, spans)
+
+
+# Lines the printer collects before writing them out.
+PRINT_CHUNK_LINES = 512
+
+
+class Printer:
     """
-    Pretty colors for output.
+    Writes the results of a search to a stream, in one write per file or
+    per PRINT_CHUNK_LINES lines of a file with many matches. Colors are used if color is True, or if it is None and the stream is
+    a terminal. With context, groups of lines that are not adjacent are
+    separated by a -- line.
     """
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
+    FORMATS = ('pretty', 'json', 'vimgrep', 'count', 'files')
+
+    format = 'pretty'
+    stream = None
+    colors = Colors
+    context = False
+
+
+    def __init__(self, format='pretty', color=None, stream=None, context=False):
+        self.format = format
+        self.stream = stream or sys.stdout
+        self.context = context
+        if color is None:
+            color = self.stream.isatty()
+        self.colors = Colors if color else NoColors
+
+
+    def matches(self, path, matches):
+        """
+        Writes the matches of one file in the selected format, those of
+        every archive member under its own name. Matches may be an iterator
+        yielding them while the file is searched, they are written as they
+        come.
+        """
+        lines = []
+        write = getattr(self, '_' + self.format)
+        for name, group in groupby(matches, attrgetter('path')):
+            for line in write(name, group):
+                lines.append(line)
+                if len(lines) == PRINT_CHUNK_LINES:
+                    self.stream.write(''.join(lines))
+                    lines = []
+        if lines:
+            self.stream.write(''.join(lines))
+
+
+    def message(self, text):
+        self.stream.write(text + '\n')
+
+
+    def _pretty(self, path, matches):
+        yield self.colors.OKGREEN + path + '\n'
+        previous = None
+        for m in matches:
+            if self.context and previous is not None and m.lineno > previous + 1:
+                yield '--\n'
+            previous = m.lineno
+            if m.context:
+                yield self.format_line(m.lineno, m.line, (), '-') + '\n'
+            elif m.labels:
+                labels = ', '.join(dict.fromkeys(m.labels))
+                yield '%s  %s[%s]%s\n' % (self.format_line(m.lineno, m.line, m.spans),
+                                          self.colors.HEADER, labels, self.colors.ENDC)
+            else:
+                yield self.format_line(m.lineno, m.line, m.spans) + '\n'
+        yield self.colors.ENDC + '\n'
+
+
+    def _json(self, path, matches):
+        for m in matches:
+            record = {
+                'type': 'context' if m.context else 'match',
+                'path': path,
+                'line': m.lineno,
+                'offset': m.offset,
+                'text': m.line.rstrip('\r\n'),
+                'matches': [{'column': column, 'offset': offset, 'text': text}
+                            for column, offset, text in m.columns()],
+            }
+            for match, label in zip(record['matches'], m.labels or ()):
+                match['pattern'] = label
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+    def _vimgrep(self, path, matches):
+        for m in matches:
+            text = m.line.rstrip('\r\n')
+            for column, _, _ in () if m.context else m.columns():
+                yield '%s:%d:%d:%s\n' % (path, m.lineno, column, text)
+
+
+    def _count(self, path, matches):
+        return ['%s:%d\n' % (path, sum(not m.context for m in matches))]
+
+
+    def _files(self, path, matches):
+        return [path + '\n']
+
+
+    def format_line(self, head, line, spans, separator=' '):
+        """
+        Formats a line with color. Head is for example for the line number,
+        while line is the text to print itself, it gets stripped.
+        Spans are (start, end) offsets into line to highlight. Separator
+        follows the head, - marks context lines.
+        """
+        colors = self.colors
+        content = line.strip()
+        offset = len(line) - len(line.lstrip())
+        parts = []
+        pos = 0
+        for start, end in spans:
+            start = min(max(start - offset, pos), len(content))
+            end = min(max(end - offset, start), len(content))
+            parts.append(content[pos:start])
+            parts.append(colors.WARNING + content[start:end] + colors.ENDC)
+            pos = end
+        parts.append(content[pos:])
+        fmt = '%s%05d%s %s%s' % (colors.OKBLUE, head, separator, colors.ENDC,
+                                 ''.join(parts),)
+        return fmt
+
+
+class RootSummary:
+    """
+    The counters of one searched directory, when several are searched.
+    """
+    __slots__ = ('directory', 'prefix', 'num_dirs', 'num_files',
+                 'num_matches_files', 'num_matches_strings')
+
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.prefix = os.path.join(directory, '')
+        self.num_dirs = 0
+        self.num_files = 0
+        self.num_matches_files = 0
+        self.num_matches_strings = 0
+
+
+def distinct_roots(directories, known=()):
+    """
+    Returns directories without those that are the same directory as an
+    earlier one or one in known, however they are spelled. Raises
+    ValueError if one is inside another, its files would be searched twice.
+    """
+    seen = {os.path.realpath(d): d for d in known}
+    roots = []
+    for directory in directories:
+        real = os.path.realpath(directory)
+        if real in seen:
+            continue
+        for other, spelled in seen.items():
+            if os.path.commonpath((real, other)) in (real, other):
+                raise ValueError('%s and %s are nested' % (spelled, directory))
+        seen[real] = directory
+        roots.append(directory)
+    return roots
+
+
+# Why a walked file was not searched, as --stats counts them, and how many
+# of the slowest files it lists.
+SKIP_REASONS = ('ignored', 'age', 'size', 'index', 'binary', 'unreadable')
+STATS_SLOWEST = 10
 
 
 class Textfinder:
     wildcard = None
     regex = None
+    prog = None
+    bprog = None
+    mprog = None
+    literals = None
     interactive = False
     replacement = None
+    jobs = 1
+    binary = False
+    max_filesize = None
+    newer_than = None
+    ignore_rules = True
+    hidden = False
+    index_file = None
+    confirm = True
+    dry_run = False
+    printer = None
+    first_match = False
+    before = 0
+    after = 0
+    multiline = False
+    decompress = False
+    stats = False
+
+    # In watch mode, the directories walked with the ignore rules that apply
+    # inside them, and the files found with their number of matched lines.
+    _watched = None
+    _found = None
+
+    # The searched directories, in the order their results are reported.
+    roots = ()
+
+    # What the file being searched costs, see search_batch().
+    _scanned = 0
+    _skipped = None
+    _read_time = 0.0
+
+    # Files below MMAP_MIN_SIZE are read into this buffer, see search_string().
+    _buffer = b''
+
+    # The directory of the preview spool files while replacing in batch.
+    _spool_dir = None
 
     num_files = 0
     num_dirs = 0
@@ -37,140 +1517,1194 @@ class Textfinder:
     num_matches_files = 0
     num_replaces = 0
 
+    # Only kept with --stats. Read and match times are summed over the
+    # worker processes, walk and total time are those of this process.
+    # Skipped files are counted by reason, directories the walk did not
+    # enter apart, as pruned.
+    num_searched = 0
+    num_bytes = 0
+    num_skipped = None
+    num_pruned = 0
+    time_walk = 0.0
+    time_read = 0.0
+    time_match = 0.0
+    time_total = 0.0
+
 
-    def __init__(self, wildcard, regex, interactive=False, replacement=None):
+    def __init__(self, wildcard, regex, interactive=False, replacement=None,
+                 jobs=None, binary=False, max_filesize=None, ignore_rules=True,
+                 hidden=False, exclude=(), exclude_dir=(), index_file=None,
+                 confirm=True, dry_run=False, printer=None, before=0,
+                 after=0, multiline=False, decompress=False, fixed=False,
+                 stats=False, include=(), types=(), newer_than=None):
         self.wildcard = wildcard
+        # '*' also matches a slash, so it lets every path through
+        self._wildcard = None if wildcard == '*' else re.compile(fnmatch.translate(wildcard))
+        # Several patterns are searched as one combined regex, and every
+        # match is labelled with the pattern it came from.
+        self._groups = self._literals = None
+        patterns = [regex] if isinstance(regex, str) else list(regex)
+        if fixed or len(patterns) > 1:
+            regex, self._groups, self._literals = combine_patterns(patterns, fixed)
+        else:
+            regex = patterns[0]
+        self.patterns = patterns
         self.regex = regex
+        self.prog = re.compile(regex)
+        self._bline = None
+        if bytes_safe(regex):
+            # MULTILINE makes ^ and $ work per line within the whole buffer.
+            self.bprog = re.compile(regex.encode('ascii'), re.MULTILINE)
+            self._anchors_line_end = _anchors_line_end(regex)
+            # A bytes pattern whose matches stay within a line finds the
+            # same spans in a raw line as the text pattern in the decoded
+            # one, so lines only get decoded to be printed. Not if it can
+            # match empty, between the bytes of a multibyte character.
+            if not _spans_lines(regex) and not _matches_empty(regex):
+                self._bline = re.compile(regex.encode('ascii'))
+
+        # Required literals reject files, and with a bytes pattern that can
+        # not span lines also the lines between literal hits, before the
+        # regex engine runs. Several alternatives are searched as one trie
+        # shaped alternation, built over latin-1 so every byte is a char.
+        self.literals = required_literals(regex)
+        self._literal_prog = None
+        if self.literals and len(self.literals) > 1:
+            words = [l.decode('latin-1') for l in self.literals]
+            self._literal_prog = re.compile(trie_regex(words).encode('latin-1'))
+        self._line_prefilter = bool(self.literals and self.bprog is not None and
+                                    not _spans_lines(regex))
         self.interactive = interactive
         self.replacement = replacement
+        self.jobs = jobs or os.cpu_count() or 1
+        self.binary = binary
+        self.max_filesize = max_filesize
+        self.newer_than = newer_than
+        self.ignore_rules = ignore_rules
+        self.hidden = hidden
+        self._exclude = _compile_globs(exclude)
+        self._exclude_dir = _compile_globs(exclude_dir)
+        self._include = _compile_globs(list(include) +
+                                       [glob for name in types for glob in FILE_TYPES[name]])
+        self.index_file = index_file
+        self.confirm = confirm
+        self.dry_run = dry_run
+        self.printer = printer or Printer()
+        # Listing files only needs the first matching line of each, and
+        # only formats that show lines get context around them.
+        self.first_match = self.printer.format == 'files'
+        if self.printer.format in ('pretty', 'json'):
+            self.before = before
+            self.after = after
+        self.decompress = decompress
+        self.multiline = multiline
+        if multiline:
+            self.mprog = re.compile(regex, re.MULTILINE)
+        self.stats = stats
+        self.num_skipped = dict.fromkeys(SKIP_REASONS, 0)
+        self._slowest = []
+        self._edits = []
+
+
+    def __getstate__(self):
+        """
+        Leaves out what only the main process uses when the finder is sent
+        to the worker processes.
+        """
+        state = self.__dict__.copy()
+        del state['printer']
+        state['_edits'] = []
+        state.pop('_watched', None)
+        state.pop('_found', None)
+        state['_slowest'] = []
+        state.pop('_buffer', None)
+        return state
 
 
     def textfinder(self, directory):
         """
-        Finds a string inside files in a directory and pretty print them.
+        Finds a string inside files in a directory, or a list of them, and
+        pretty print them. Files are searched by a pool of worker processes,
+        results are printed by this process in walk order.
+        """
+        if self._batch_replace():
+            # where the workers spool long previews, see Previews
+            self._spool_dir = tempfile.mkdtemp(prefix='textfinder-')
+        results = self._results(directory)
+        try:
+            for result in results:
+                self._report([result])
+            self.commit_edits()
+        finally:
+            results.close()
+            for _, tmp, _, _ in self._edits:
+                os.unlink(tmp)
+            self._edits = []
+            if self._spool_dir is not None:
+                shutil.rmtree(self._spool_dir, ignore_errors=True)
+                self._spool_dir = None
+
+
+    def search(self, directory):
+        """
+        Yields a Match record for every matched line, and every context line
+        around one, of the files in a directory or a list of them. Files are
+        searched as the
+        records are consumed and yielded file by file in walk order, so
+        stopping early stops the search. Nothing is printed, the counters
+        are kept as by textfinder().
+        """
+        if self.replacement is not None:
+            raise ValueError('search() does not replace, use textfinder()')
+        for file, matches, _, stats in self._results(directory):
+            yield from self._counted(file, matches, stats)
+
+
+    def _results(self, directory):
+        """
+        Yields what search_batch() returns for every searched file below
+        directory, or below every directory of a list in turn, in walk
+        order. The walks of all directories feed the same workers, so the
+        files of the next directory are searched while those of the last
+        one are still reported. Without worker processes every file is
+        searched only when the previous result was consumed, and unless
+        something is replaced or asked, its matches are an iterator that
+        searches the file while they are consumed.
+        A remote agent would plug in here, walking and running
+        search_batch() on another host and streaming back its results.
+        """
+        started = time.perf_counter()
+        directories = [directory] if isinstance(directory, str) else list(directory)
+        known = [root.directory for root in self.roots]
+        self.roots = tuple(self.roots) + tuple(
+            RootSummary(d) for d in distinct_roots(directories, known))
+        # a directory searched before keeps the spelling its summary has
+        spelled = {os.path.realpath(d): d for d in known}
+        directories = [spelled.get(os.path.realpath(d), d)
+                       for d in distinct_roots(directories)]
+        paths = (path for d in directories for path in self.walk(d))
+        if self.stats:
+            paths = self._timed_walk(paths)
+        if self.index_file:
+            paths = self._indexed(paths)
+        try:
+            if self.jobs == 1:
+                streamed = self.replacement is None and not self.interactive
+                for path in paths:
+                    if streamed:
+                        yield path, self._search_streamed(path), None, None
+                    else:
+                        yield from self.search_batch([path])
+            else:
+                pool = ProcessPoolExecutor(self.jobs, initializer=_init_worker, initargs=(self,))
+                try:
+                    depth = self.jobs * TASKS_PER_JOB
+                    for results in _ordered_map(pool, _search_batch, self._batches(paths), depth):
+                        yield from results
+                finally:
+                    # stopping early drops the batches not started yet
+                    pool.shutdown(cancel_futures=True)
+        finally:
+            self.time_total += time.perf_counter() - started
+
+
+    def _timed_walk(self, paths):
+        """
+        Yields the walked paths, adding the time spent walking to time_walk.
+        """
+        while True:
+            started = time.perf_counter()
+            path = next(paths, None)
+            self.time_walk += time.perf_counter() - started
+            if path is None:
+                return
+            yield path
+
+
+    def _indexed(self, paths):
+        """
+        Brings the trigram index up to date for the walked paths, then yields
+        only those the index says may match, in walk order.
+        """
+        paths = list(paths)
+        index = TrigramIndex.load(self.index_file)
+        # the bytes of a compressed file say nothing about its text
+        bypass = {path for path in paths if self.decompress and compressed(path)}
+        stale = [path for path in paths if path not in bypass and index.stale(path)]
+        if self.jobs > 1 and len(stale) > BATCH_SIZE:
+            with ProcessPoolExecutor(self.jobs) as pool:
+                for entry in pool.map(file_trigrams, stale, chunksize=16):
+                    index.add(*entry)
+        else:
+            for entry in map(file_trigrams, stale):
+                index.add(*entry)
+
+        walked = set(paths)
+        for path in list(index.ids):
+            if path not in walked and not os.path.exists(path):
+                index.remove(path)
+        index.save()
+
+        candidates = index.candidates(trigram_query(self.regex))
+        for path in paths:
+            if candidates is None or path in candidates or path in bypass:
+                yield path
+            else:
+                self.num_skipped['index'] += 1
+
+
+    def watch(self, directory, poll=False):
+        """
+        Searches directory, or a list of them, then keeps watching and
+        searches again only the files that changed or appeared, and the
+        directories created since. Matches and the summary are printed after
+        every change.
+        """
+        self._watched = {}
+        self._found = {}
+        self.textfinder(directory)
+        self.summary()
+
+        watcher = None if poll else Inotify.create()
+        if watcher is None or not watcher.sync(self._watched):
+            if watcher is not None:
+                watcher.close()
+            watcher = Poller(self._found)
+            watcher.sync(self._watched)
+        try:
+            while True:
+                paths = watcher.wait()
+                if paths is None:
+                    # events were lost, look at every known file again
+                    paths = set(self._found) | set(self._watched)
+                self._update(sorted(paths))
+                watcher.sync(self._watched)
+                self.summary()
+        finally:
+            watcher.close()
+
+
+    def _update(self, paths):
+        """
+        Searches changed files again and walks new directories, and takes
+        what was deleted out of the results.
         """
-        # iterate every file in this directory
-        for file in os.listdir(directory):
-            # call textfinder again if this is a directory, 
-            # otherwise,find matches if it matches the wildcard.
-            file = directory + '/' + file
+        changed = []
+        for path in paths:
+            levels = self._watched.get(os.path.dirname(path))
+            if not os.path.exists(path):
+                self._forget(path)
+            elif levels is None:
+                continue
+            elif os.path.isdir(path):
+                if path not in self._watched and not self._pruned(
+                        os.path.basename(path), path, True, levels):
+                    self._add_walked(path, 1, 0)
+                    changed.extend(self.walk(path, levels))
+            elif path in self._found:
+                changed.append(path)
+            elif (not self._pruned(os.path.basename(path), path, False, levels) and
+                    self._selected(_PathEntry(path))):
+                self._add_walked(path, 0, 1)
+                changed.append(path)
 
-            if os.path.isdir(file):
-                self.textfinder(file)
+        colors = self.printer.colors
+        for path in dict.fromkeys(changed):
+            count = self._found.pop(path, 0)
+            self._add_matches(path, -count, -bool(count))
+            self._report(self.search_batch([path]))
+            if count and not self._found[path]:
+                self.printer.message(colors.OKGREEN + path + colors.ENDC + ': no matches')
+
+
+    def _forget(self, path):
+        """
+        Drops a deleted file, or a deleted directory and all below it, from
+        the results and the counters. The searched directories themselves
+        were never counted.
+        """
+        below = path + os.sep
+        roots = {root.directory for root in self.roots}
+        for directory in [d for d in self._watched if d == path or d.startswith(below)]:
+            del self._watched[directory]
+            if directory not in roots:
+                self._add_walked(directory, -1, 0)
+        for file in [f for f in self._found if f == path or f.startswith(below)]:
+            count = self._found.pop(file)
+            self._add_walked(file, 0, -1)
+            self._add_matches(file, -count, -bool(count))
+            if count:
+                self.printer.message(self.printer.colors.OKGREEN + file +
+                                     self.printer.colors.ENDC + ': removed')
+
+
+    def walk(self, directory, levels=None):
+        """
+        Yields the files below directory that _selected() lets through,
+        depth first. Uses os.scandir so the type of an entry comes from the
+        directory listing instead of a stat call per entry.
+        Hidden entries, --exclude/--exclude-dir globs and .gitignore/.ignore
+        rules prune entries before anything is read below them. Levels are
+        the ignore rules that apply in directory, by default those of its
+        parent directories.
+        """
+        if levels is None:
+            levels = _parent_ignore_rules(directory) if self.ignore_rules else ()
+        # counted again for the searched directory the walk is in, if any
+        root = self._root_of(directory) or RootSummary(directory)
+        stack = [self._scandir(directory, levels)]
+        while stack:
+            entries, levels = stack[-1]
+            entry = next(entries, None)
+            if entry is None:
+                stack.pop()
+                continue
+
+            is_dir = entry.is_dir()
+            if self._pruned(entry.name, entry.path, is_dir, levels):
+                if is_dir:
+                    self.num_pruned += 1
+                else:
+                    self.num_skipped['ignored'] += 1
+                continue
+            if is_dir:
+                stack.append(self._scandir(entry.path, levels))
                 self.num_dirs += 1
-            elif fnmatch.fnmatch(file, self.wildcard) and os.path.isfile(file):
-                matches = self.search_string(file)
-                if matches:
-                    self.num_matches_strings += len(matches)
-                    self.num_matches_files += 1
-                    self.num_files += 1
-                    print(Colors.OKGREEN + '%s' % (file, ))
-
-                if matches and self.replacement == None:
-                    for match in matches:
-                        print(match)
-                    print(Colors.ENDC)
-                    if self.interactive:
-                        raw_input()
-                elif matches and self.replacement:
-                    self.replace_string(file)
-                    print(Colors.OKGREEN + 'End of file')
+                root.num_dirs += 1
+                continue
+            self.num_files += 1
+            root.num_files += 1
+            if self._selected(entry):
+                if self._found is not None:
+                    self._found.setdefault(entry.path, 0)
+                yield entry.path
+
+
+    def _root_of(self, path):
+        """
+        Returns the RootSummary of the searched directory path is in, the
+        one with the longest matching spelling, or None.
+        """
+        found = None
+        for root in self.roots:
+            if path == root.directory or path.startswith(root.prefix):
+                if found is None or len(root.prefix) > len(found.prefix):
+                    found = root
+        return found
+
+
+    def _scandir(self, directory, levels):
+        """
+        Lists directory, returns an iterator over its entries and the ignore
+        rule levels that apply inside it.
+        """
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return iter(()), levels
+
+        if self.ignore_rules:
+            names = [e.name for e in entries if e.name in IGNORE_FILES]
+            rules = names and IgnoreRules.load(directory, sorted(names, key=IGNORE_FILES.index))
+            if rules:
+                levels = levels + (rules,)
+        if self._watched is not None:
+            self._watched[directory] = levels
+        return iter(entries), levels
+
+
+    def _selected(self, entry):
+        """
+        Tells whether a walked file is searched: its path matches the
+        wildcard, its name an --include or --type glob, and its size and
+        modification time the --max-filesize and --newer-than limits. The
+        name tests come first, and the stat of the entry is only asked
+        for, once, when a limit is set.
+        """
+        if self._wildcard is not None and not self._wildcard.match(entry.path):
+            return False
+        if self._include is not None and not self._include.match(entry.name):
+            return False
+        if not entry.is_file():
+            return False
+        if self.max_filesize is None and self.newer_than is None:
+            return True
+        st = entry.stat()
+        if self.max_filesize is not None and st.st_size > self.max_filesize:
+            self.num_skipped['size'] += 1
+            return False
+        if self.newer_than is not None and st.st_mtime < self.newer_than:
+            self.num_skipped['age'] += 1
+            return False
+        return True
+
+
+    def _pruned(self, name, path, is_dir, levels):
+        """
+        Tells whether an entry is skipped by the hidden, exclude or ignore
+        rules.
+        """
+        if not self.hidden and name.startswith('.'):
+            return True
+        if is_dir:
+            if self.ignore_rules and name == '.git':
+                return True
+            if self._exclude_dir and self._exclude_dir.match(name):
+                return True
+        elif self._exclude and self._exclude.match(name):
+            return True
+
+        for rules in reversed(levels):
+            ignored = rules.match(path, is_dir)
+            if ignored is not None:
+                return ignored
+        return False
+
+
+    def _batches(self, paths):
+        batch = []
+        for path in paths:
+            batch.append(path)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+    def _batch_replace(self):
+        return self.replacement is not None and (self.dry_run or not self.confirm)
+
+
+    def search_batch(self, paths):
+        """
+        Searches a list of files, returns a list of (file, matches, plan,
+        stats) tuples. In batch replace mode matches is only the number of
+        matched lines, and plan is what plan_replace() returned for a file
+        with matches, its previews show the lines. Unreadable files and broken
+        compressed files count as files without matches. With --stats,
+        stats is (bytes scanned, skip reason or None, read seconds, match
+        seconds) for the file, else None.
+        """
+        results = []
+        batch_replace = self._batch_replace()
+        for path in paths:
+            started = time.perf_counter()
+            self._scanned = 0
+            self._skipped = None
+            self._read_time = 0.0
+            try:
+                plan = None
+                if batch_replace:
+                    matches = sum(not m.context for m in self._search_file(path))
+                    if matches:
+                        plan = self.plan_replace(path)
+                else:
+                    matches = self.search_string(path)
+            except (OSError,) + DECOMPRESSION_ERRORS:
+                matches, plan = 0 if batch_replace else [], None
+                self._skipped = 'unreadable'
+            stats = None
+            if self.stats:
+                elapsed = time.perf_counter() - started
+                stats = (self._scanned, self._skipped, self._read_time,
+                         elapsed - self._read_time)
+            results.append((path, matches, plan, stats))
+        return results
+
+
+    def _search_streamed(self, path):
+        """
+        Searches a file in this process and yields its matches as they are
+        found, as search_batch() returns them at once. The --stats of the
+        file are added once it is done, without the time spent by the
+        consumer in between.
+        """
+        started = time.perf_counter()
+        self._scanned = 0
+        self._skipped = None
+        self._read_time = 0.0
+        paused = 0.0
+        try:
+            for m in self._search_file(path):
+                resumed = time.perf_counter()
+                yield m
+                paused += time.perf_counter() - resumed
+        except (OSError,) + DECOMPRESSION_ERRORS:
+            self._skipped = 'unreadable'
+        if self.stats:
+            elapsed = time.perf_counter() - started - paused
+            self._add_stats(path, self._scanned, self._skipped, self._read_time,
+                            elapsed - self._read_time)
+
+
+    def _report(self, results):
+        """
+        Prints the matches of a searched batch and updates the counters.
+        """
+        for file, matches, plan, stats in results:
+            if self.replacement is None and not self.interactive:
+                self.printer.matches(file, self._counted(file, matches, stats))
+                continue
+
+            if self._batch_replace():
+                found = matches
+            else:
+                found = sum(not m.context for m in matches)
+            self._count(file, found, stats)
+            if not found:
+                continue
+
+            if plan:
+                previews, edit = plan
+                try:
+                    self.printer.matches(file, previews)
+                finally:
+                    previews.discard()
+                if edit:
+                    self._edits.append(edit)
+                    self.num_replaces += edit[2]
+            elif self.replacement is None:
+                self.printer.matches(file, matches)
+                input()
             else:
-                self.num_files += 1
+                self.printer.message(self.printer.colors.OKGREEN + file)
+                self.replace_string(file)
+                self.printer.message(self.printer.colors.OKGREEN + 'End of file')
+
+
+    def _counted(self, file, matches, stats):
+        """
+        Yields the matches of a file, and counts those consumed once the
+        consumer is done with them, also if it stops early.
+        """
+        found = 0
+        try:
+            for m in matches:
+                found += not m.context
+                yield m
+        finally:
+            self._count(file, found, stats)
+
+
+    def _count(self, file, found, stats):
+        if self._found is not None:
+            self._found[file] = found
+        if stats:
+            self._add_stats(file, *stats)
+        if found:
+            self._add_matches(file, found, 1)
+
+
+    def _add_walked(self, path, dirs, files):
+        self.num_dirs += dirs
+        self.num_files += files
+        root = self._root_of(path)
+        if root is not None:
+            root.num_dirs += dirs
+            root.num_files += files
+
+
+    def _add_matches(self, file, strings, files):
+        self.num_matches_strings += strings
+        self.num_matches_files += files
+        root = self._root_of(file)
+        if root is not None:
+            root.num_matches_strings += strings
+            root.num_matches_files += files
+
+
+    def _add_stats(self, file, scanned, skipped, read, match):
+        if skipped:
+            self.num_skipped[skipped] += 1
+        else:
+            self.num_searched += 1
+            self.num_bytes += scanned
+        self.time_read += read
+        self.time_match += match
+        entry = (read + match, file)
+        if len(self._slowest) < STATS_SLOWEST:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
 
 
     def search_string(self, filename):
         """
-        Search something in a file based on regex. Prints out the occurence 
-        with the line numbers.
+        Search something in a file based on regex. Returns a list of Match
+        records, only the first one if first_match is set, with the context
+        lines around them in line order.
         """
-        f = open(filename, 'r', encoding='utf-8', errors='ignore')
-        matches = []
+        return list(self._search_file(filename))
 
-        # compile regex first
-        regex = '(.*)(%s)(.*)' % (self.regex,)
-        prog = re.compile(regex)    
 
-        # iterate every line in the file and print matches
-        i = 0
-        for line in f:
-            i += 1
-            if prog.match(line):
-                stripped = line.strip()
-                match = self._format_line(i, stripped, regex)
-                matches.append(match)
-        f.close()
-        return matches
+    def _search_file(self, filename):
+        """
+        Yields the Match records search_string() returns while the file is
+        searched.
+        """
+        if self.decompress and compressed(filename):
+            yield from self._search_compressed(filename)
+            return
+
+        started = time.perf_counter()
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.max_filesize is not None and size > self.max_filesize:
+                self._skipped = 'size'
+                return
+            if not size:
+                return
+            if size < MMAP_MIN_SIZE:
+                buf, size = self._read_whole(f, size)
+            else:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        with buf if isinstance(buf, mmap.mmap) else contextlib.nullcontext():
+            encoding = detect_encoding(buf[:min(size, BINARY_PROBE_SIZE)])
+            if encoding in WIDE_ENCODINGS:
+                if self.multiline:
+                    data = b''.join(self._reading(_transcoded(io.BytesIO(buf[:size]), encoding)))
+                    self._scanned = size
+                    yield from self._search_multiline(filename, data)
+                    return
+            else:
+                if not self.binary and buf.find(b'\0', 0, min(size, BINARY_PROBE_SIZE)) != -1:
+                    self._skipped = 'binary'
+                    return
+                self._scanned = size
+                if self.stats:
+                    # pages of a mapping are read in as they are matched
+                    self._read_time += time.perf_counter() - started
+                if self.literals and self._find_literal(buf, 0, size) == -1:
+                    return
+                if self.multiline:
+                    yield from self._search_multiline(filename, buf[:size])
+                    return
+                if (self.bprog is not None and not (self.before or self.after or encoding) and
+                        not self._needs_line_mode(buf, size)):
+                    yield from self._search_mapped(filename, buf, size)
+                    return
+        with open(filename, 'rb') as f:
+            self._scanned = size
+            if encoding in WIDE_ENCODINGS:
+                yield from self._search_lines(filename, self._reading(_transcoded(f, encoding)))
+            else:
+                yield from self._search_lines(filename, self._reading(_blocks(f)))
+
+
+    def _read_whole(self, f, size):
+        """
+        Reads the file f of size bytes into the buffer kept for reading
+        files whole, grown when a file does not fit. Returns the buffer and
+        the number of bytes read, fewer if the file was truncated meanwhile.
+        """
+        if len(self._buffer) < size:
+            self._buffer = bytearray(size)
+        with memoryview(self._buffer) as view, view[:size] as target:
+            return self._buffer, f.readinto(target)
+
+
+    def _reading(self, blocks):
+        """
+        Yields the blocks of a file, with --stats adding the time spent
+        reading and decoding them to the read time of the file.
+        """
+        if not self.stats:
+            yield from blocks
+            return
+        blocks = iter(blocks)
+        while True:
+            started = time.perf_counter()
+            data = next(blocks, None)
+            self._read_time += time.perf_counter() - started
+            if data is None:
+                return
+            yield data
+
+
+    def _search_compressed(self, filename):
+        """
+        Searches a compressed file while it is decompressed, or every member
+        of a ZIP archive in turn. Nothing is written to disk, and the reading
+        stops at the first match if first_match is set.
+        """
+        size = os.path.getsize(filename)
+        if self.max_filesize is not None and size > self.max_filesize:
+            self._skipped = 'size'
+            return
+        self._scanned = size
+        suffix = os.path.splitext(filename)[1].lower()
+        if suffix in COMPRESSION_OPENERS:
+            with COMPRESSION_OPENERS[suffix](filename, 'rb') as f:
+                yield from self._search_stream(filename, f)
+            return
+
+        found = False
+        with zipfile.ZipFile(filename) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                with archive.open(member) as f:
+                    for m in self._search_stream('%s:%s' % (filename, member.filename), f):
+                        found = True
+                        yield m
+                if found and self.first_match:
+                    break
+
+
+    def _search_stream(self, name, f):
+        """
+        Searches a decompressed stream, skipping it if it looks binary.
+        """
+        head = f.peek(BINARY_PROBE_SIZE)[:BINARY_PROBE_SIZE]
+        encoding = detect_encoding(head)
+        if encoding in WIDE_ENCODINGS:
+            blocks = self._reading(_transcoded(f, encoding))
+        elif not self.binary and b'\0' in head:
+            self._skipped = 'binary'
+            return
+        else:
+            blocks = self._reading(_blocks(f))
+        if self.multiline:
+            yield from self._search_multiline(name, b''.join(blocks))
+        else:
+            yield from self._search_lines(name, blocks)
+
+
+    def _find_literal(self, buf, pos, endpos):
+        """
+        Returns the offset of the next required literal between pos and
+        endpos, or -1.
+        """
+        if self._literal_prog is None:
+            return buf.find(self.literals[0], pos, endpos)
+        m = self._literal_prog.search(buf, pos, endpos)
+        return m.start() if m else -1
+
+
+    def _needs_line_mode(self, buf, size):
+        """
+        Tells whether the file buffer has to be searched in line mode:
+        universal newlines turn a lone CR into a line break, and CRLF breaks
+        bytes level $ anchors.
+        """
+        return buf.find(b'\r', 0, size) != -1 and bool(self._anchors_line_end or
+                                                       LONE_CR.search(buf, 0, size))
+
+
+    def _search_mapped(self, filename, buf, size):
+        """
+        Runs the bytes pattern over the first size bytes of the file buffer,
+        mapped or read, in one pass, and only looks at lines around its
+        hits. A hit is confirmed on its line alone, and the search resumes
+        at the next line so a hit spanning lines can not hide a real match.
+        Yields a Match record for every matched line.
+        """
+        lineno = 1
+        counted = 0
+        pos = 0
+        while True:
+            endpos = size
+            if self._line_prefilter:
+                # only the line around the next literal can match
+                hit = self._find_literal(buf, pos, size)
+                if hit == -1:
+                    break
+                pos = buf.rfind(b'\n', 0, hit) + 1
+                endpos = buf.find(b'\n', hit, size) + 1 or size
+
+            m = self.bprog.search(buf, pos, endpos)
+            if m is None:
+                if endpos == size:
+                    break
+                pos = endpos
+                continue
+            start = buf.rfind(b'\n', 0, m.start()) + 1
+            if start == size:
+                break   # zero width hit after the last newline
+            end = buf.find(b'\n', m.start(), size) + 1 or size
+            lineno += buf[counted:start].count(b'\n')
+            counted = start
+
+            raw = bytes(buf[start:end])
+            if raw.endswith(b'\r\n'):
+                raw = raw[:-2] + b'\n'
+            hit = self._match_line(raw)
+            if hit:
+                line, encoding, spans, labels = hit
+                yield Match(filename, lineno, start, line, spans,
+                            labels=labels, encoding=encoding)
+                if self.first_match:
+                    break
+            if end == size:
+                break
+            pos = end
+
+
+    def _search_lines(self, filename, blocks):
+        """
+        Tests the pattern line by line on blocks of whole lines of a file.
+        Lines are split and end the way universal newlines make them, and
+        each block is decoded at once, keeping track of its byte offset so
+        every match knows the offset of its line. The lines before a match
+        are kept in a ring buffer as long as the context they may become.
+        Yields the matched and context lines as they are found.
+        """
+        before = deque(maxlen=self.before)
+        after = 0
+        lineno = 0
+        base = 0
+        search = self.prog.search
+        for data in blocks:
+            if not lineno and data.startswith(codecs.BOM_UTF8):
+                data = data[len(codecs.BOM_UTF8):]
+                base += len(codecs.BOM_UTF8)
+            block = _Block(data, base)
+            base += len(data)
+            cr = '\r' in block.text
+            pos = 0
+            for line in io.StringIO(block.text, newline=''):
+                start = pos
+                pos += len(line)
+                lineno += 1
+                if cr:
+                    if line.endswith('\r\n'):
+                        line = line[:-2] + '\n'
+                    elif line.endswith('\r'):
+                        line = line[:-1] + '\n'
+                if search(line):
+                    for args in before:
+                        yield self._context_line(filename, *args)
+                    before.clear()
+                    offset, encoding = block.locate(start)
+                    spans, labels = self._hits(line)
+                    yield Match(filename, lineno, offset, line, spans,
+                                labels=labels, encoding=encoding)
+                    if self.first_match:
+                        return
+                    after = self.after
+                elif after:
+                    yield self._context_line(filename, lineno, line, block, start)
+                    after -= 1
+                elif self.before:
+                    before.append((lineno, line, block, start))
+
+
+    def _context_line(self, filename, lineno, line, block, pos):
+        offset, encoding = block.locate(pos)
+        return Match(filename, lineno, offset, line, [], True, encoding=encoding)
+
+
+    def _match_line(self, raw):
+        """
+        Tests a raw line that ends in a plain newline. Returns the decoded
+        line, its encoding, and the spans and labels of the matches in it,
+        or None. With a bytes pattern the line is only decoded if it
+        matched, and the byte spans are turned into character spans.
+        """
+        if self._bline is not None:
+            found = list(self._bline.finditer(raw))
+            if not found:
+                return None
+            spans = [m.span() for m in found]
+            labels = None
+            if self._groups is not None:
+                labels = [self._pattern_of(m) for m in found]
+            line, encoding = _decode_line(raw)
+            if not raw.isascii():
+                spans = [(len(raw[:start].decode(encoding)), len(raw[:end].decode(encoding)))
+                         for start, end in spans]
+            return line, encoding, spans, labels
+
+        line, encoding = _decode_line(raw)
+        if not self.prog.search(line):
+            return None
+        spans, labels = self._hits(line)
+        return line, encoding, spans, labels
+
+
+    def _hits(self, line):
+        """
+        Returns the spans of the matches in line, and the pattern of every
+        match when several patterns are searched, else None.
+        """
+        found = list(self.prog.finditer(line))
+        labels = None
+        if self._groups is not None:
+            labels = [self._pattern_of(m) for m in found]
+        return [m.span() for m in found], labels
+
+
+    def _pattern_of(self, m):
+        name = m.lastgroup
+        if name == LITERALS_GROUP:
+            text = m.group(name)
+            return self._literals[text.decode('ascii') if isinstance(text, bytes) else text]
+        return self._groups[name]
+
+
+    def _search_multiline(self, filename, buf):
+        """
+        Decodes the whole mapped file, or decompressed data, into one text
+        with universal newlines and runs the pattern over it with ^ and $
+        matching at every line, so a match can span lines. Every line a
+        match touches is reported with the part of the match on it.
+        """
+        lines = []
+        encodings = []
+        offsets = array('q')
+        starts = array('q')
+        offset = pos = 0
+        for raw in buf[:].splitlines(True):
+            if not lines and raw.startswith(codecs.BOM_UTF8):
+                raw = raw[len(codecs.BOM_UTF8):]
+                offset += len(codecs.BOM_UTF8)
+            line, encoding = _decode_line(_line_break(raw))
+            lines.append(line)
+            encodings.append(encoding)
+            offsets.append(offset)
+            starts.append(pos)
+            offset += len(raw)
+            pos += len(line)
+
+        found = {}
+        labels = {}
+        for m in self.mprog.finditer(''.join(lines)):
+            start, end = m.span()
+            if start == pos and (not lines or lines[-1].endswith('\n')):
+                break   # zero width hit after the last newline
+            first = bisect.bisect_right(starts, start) - 1
+            last = bisect.bisect_right(starts, max(end - 1, start)) - 1
+            for i in range(first, last + 1):
+                found.setdefault(i, []).append((max(start - starts[i], 0),
+                                                min(end - starts[i], len(lines[i]))))
+                if self._groups is not None:
+                    labels.setdefault(i, []).append(self._pattern_of(m))
+            if self.first_match:
+                break
+
+        shown = sorted({j for i in found
+                        for j in range(max(i - self.before, 0),
+                                       min(i + self.after + 1, len(lines)))})
+        return [Match(filename, i + 1, offsets[i], lines[i], found.get(i, []),
+                      i not in found, labels.get(i), encodings[i])
+                for i in shown]
 
 
     def replace_string(self, filename):
         """
-        Replaces string occurences in a file. Always in interactive mode.
+        Replaces string occurences in a file, asking for every line. The file
+        keeps its encoding and line endings and is replaced atomically. Lines
+        are streamed into the staged copy as they are answered, so memory
+        stays at the longest line whatever the size of the file.
         """
-        data = []
-        f = open(filename, 'r')
-        rplregex = self.regex
-        rplregex2 = '(.*)(%s)(.*)' % (self.replacement,)
-        regex = '(.*)(%s)(.*)' % (self.regex,)
-        prog = re.compile(regex)    
+        replaced = 0
 
         # iterate every line in the file and print matches replaced line preview
-        i = 0
-        for line in f:
-            i += 1
-            if prog.match(line):
-                stripped = line.strip()
-
-                # formatted match
-                print(self._format_line(i, stripped, regex))
-
-                # formatted replacement preview
-                text = re.sub(rplregex, self.replacement, stripped)            
-                print(self._format_line(i, text, rplregex2))
-
-                answer = raw_input('Replace string? [y/n]\n')
-                # ignore 'n' only consider for 'y' answer
-                if answer == 'y':
-                    change = re.sub(rplregex, self.replacement, line)
-                    data.append(change)
-                    self.num_replaces += 1
-                else:
-                    data.append(line) 
-            else:
-                data.append(line)
-        f.close()
+        def lines(f, encoding):
+            nonlocal replaced
+            for i, line in enumerate(_text_lines(f, encoding), 1):
+                change, old_spans, spans = self._replace_line(line)
+                if old_spans:
+                    self.printer.message(self.printer.format_line(i, line, old_spans))
+                    self.printer.message(self.printer.format_line(i, change, spans))
+
+                    answer = input('Replace string? [y/n]\n')
+                    # ignore 'n' only consider for 'y' answer
+                    if answer == 'y':
+                        # counted per occurrence, as in batch mode
+                        replaced += len(spans)
+                        yield change
+                        continue
+                yield line
 
-        # write data to file
-        f = open(filename, 'w')
-        f.writelines(data)    
-        f.close()
+        with open(filename, 'rb') as f:
+            encoding = _file_encoding(f)
+            tmp = _stage(filename, encoding, lines(f, encoding))
 
+        self.num_replaces += replaced
+        if replaced:
+            os.replace(tmp, filename)
+        else:
+            os.unlink(tmp)
 
-    def _format_line(self, head, content, regex):
+
+    def plan_replace(self, filename):
         """
-        Formats a line with color. Head is for example for the line number,
-        while content is the text to print itself.
-        Regex is used to higlight some portion of the resulting text.
+        Replaces every occurence in a file into a staged temporary copy,
+        streamed line by line so memory stays at the longest line, and the
+        Previews of the changed lines bounded as well.
+        Returns (previews, edit) where edit is (file, temporary file, number
+        of replacements, (mtime_ns, size) of the file read) or None.
         """
-        text = re.sub(regex, '\\1' + Colors.WARNING + '\\2' + 
-                Colors.ENDC + '\\3', content)
-        fmt = '%s%05d  %s%s' % (Colors.OKBLUE, head, Colors.ENDC, text,)
-        return fmt
+        previews = Previews(filename, self._spool_dir)
+        count = 0
+
+        def lines(f, encoding):
+            nonlocal count
+            for i, line in enumerate(_text_lines(f, encoding), 1):
+                change, old_spans, spans = self._replace_line(line)
+                if old_spans:
+                    previews.append(i, line, old_spans)
+                    previews.append(i, change, spans)
+                    count += len(spans)
+                yield change
+
+        try:
+            with open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                encoding = _file_encoding(f)
+                if self.dry_run:
+                    deque(lines(f, encoding), 0)
+                    return previews, None
+                tmp = _stage(filename, encoding, lines(f, encoding))
+        except BaseException:
+            previews.discard()
+            raise
+        finally:
+            previews.close()
+
+        if not count:
+            os.unlink(tmp)
+            return previews, None
+        return previews, (filename, tmp, count, (st.st_mtime_ns, st.st_size))
+
+
+    def commit_edits(self):
+        """
+        Renames all staged files over their originals once the whole run
+        has been planned. A file that changed in the meantime is left alone.
+        """
+        edits, self._edits = self._edits, []
+        for i, (filename, tmp, count, stamp) in enumerate(edits):
+            st = os.stat(filename)
+            if (st.st_mtime_ns, st.st_size) != stamp:
+                os.unlink(tmp)
+                self.num_replaces -= count
+                colors = self.printer.colors
+                self.printer.message(colors.FAIL + 'Changed while replacing, skipped: %s'
+                                     % (filename,) + colors.ENDC)
+                continue
+            try:
+                os.replace(tmp, filename)
+            except OSError:
+                self._edits = edits[i:]
+                raise
+
+
+    def _replace_line(self, line):
+        """
+        Substitutes in one line the way a search sees it, with its line
+        break as a plain newline, and puts the original line break back.
+        Returns the new line and the spans of the matches and replacements.
+        """
+        body = line.rstrip('\r\n')
+        ending = line[len(body):]
+        probe = body + '\n' if ending else body
+        old_spans = [m.span() for m in self.prog.finditer(probe)]
+        if not old_spans:
+            return line, old_spans, []
+        change, spans = self._substitute(probe)
+        if ending and change.endswith('\n'):
+            change = change[:-1] + ending
+        return change, old_spans, spans
+
+
+    def _substitute(self, text):
+        """
+        Replaces every match in text. Returns the new text and the spans of
+        the inserted replacements in it.
+        """
+        spans = []
+        shift = 0
 
+        def expand(m):
+            nonlocal shift
+            new = m.expand(self.replacement)
+            start = m.start() + shift
+            spans.append((start, start + len(new)))
+            shift += len(new) - (m.end() - m.start())
+            return new
 
-    def summary(self):
+        return self.prog.sub(expand, text), spans
+
+
+    def summary(self, stream=None):
+        """
+        Prints the summary, and with --stats where the time went.
+        """
+        stream = stream or self.printer.stream
+        if len(self.roots) > 1:
+            stream.write(''.join(self.printer.colors.ENDC + '\n' + ''.join((
+                'Summary of %s\n' % (root.directory),
+                '-----------%s\n' % ('-' * len(root.directory)),
+                'Directories iterated:\t%d\n' % (root.num_dirs),
+                'Files iterated:\t\t%d\n' % (root.num_files),
+                'Matched files:\t\t%d\n' % (root.num_matches_files),
+                'Matched strings:\t%d\n' % (root.num_matches_strings),
+            )) for root in self.roots))
+        stream.write(''.join((
+            self.printer.colors.ENDC + '\n',
+            'Summary\n',
+            '-------\n',
+            'Directories iterated:\t%d\n' % (self.num_dirs),
+            'Files iterated:\t\t%d\n' % (self.num_files),
+            'Matched files:\t\t%d\n' % (self.num_matches_files),
+            'Matched strings:\t%d\n' % (self.num_matches_strings),
+            'Replaced strings:\t%d\n' % (self.num_replaces),
+            '\n',
+        )))
+        if self.stats:
+            stream.write(self.statistics())
+
+
+    def statistics(self):
         """
-        Prints the summary
+        Returns the --stats report: what was searched and skipped, the time
+        spent walking, reading and matching, and the slowest files.
         """
-        print(Colors.ENDC)
-        print('Summary')
-        print('-------')
-        print('Directories iterated:\t%d' % (self.num_dirs))
-        print('Files iterated:\t\t%d' % (self.num_files))
-        print('Matched files:\t\t%d' % (self.num_matches_files))
-        print('Matched strings:\t%d' % (self.num_matches_strings))
-        print('Replaced strings:\t%d' % (self.num_replaces))
-        print()
+        mb = self.num_bytes / 1e6
+        skipped = self.num_skipped
+        lines = [
+            'Statistics\n',
+            '----------\n',
+            'Files searched:\t\t%d\n' % (self.num_searched),
+            'Skipped, ignored:\t%d\n' % (skipped['ignored']),
+            'Skipped, age:\t\t%d\n' % (skipped['age']),
+            'Skipped, size:\t\t%d\n' % (skipped['size']),
+            'Skipped, index:\t\t%d\n' % (skipped['index']),
+            'Skipped, binary:\t%d\n' % (skipped['binary']),
+            'Skipped, unreadable:\t%d\n' % (skipped['unreadable']),
+            'Pruned directories:\t%d\n' % (self.num_pruned),
+            'Bytes scanned:\t\t%d (%.1f MB)\n' % (self.num_bytes, mb),
+            'Walking:\t\t%.3f s\n' % (self.time_walk),
+            'Reading:\t\t%.3f s\n' % (self.time_read),
+            'Matching:\t\t%.3f s\n' % (self.time_match),
+            'Total:\t\t\t%.3f s\n' % (self.time_total),
+            'Throughput:\t\t%.1f MB/s\n' % (mb / self.time_total if self.time_total else 0),
+            '\n',
+        ]
+        if self._slowest:
+            lines.append('Slowest files\n')
+            lines.append('-------------\n')
+            lines.extend('%.3f s\t%s\n' % entry for entry in sorted(self._slowest, reverse=True))
+            lines.append('\n')
+        return ''.join(lines)
+
+
+def search(directory, wildcard, regex, **options):
+    """
+    Yields a Match record for every line matching regex, a pattern or a
+    list of patterns, in the files below directory whose path matches the
+    wildcard. Options are those of Textfinder. Files are searched as the
+    records are consumed, e.g.
+
+        for match in itertools.islice(search('src', '*.py', r'TODO'), 10):
+            print(match.path, match.lineno, match.spans)
+    """
+    return Textfinder(wildcard, regex, **options).search(directory)
 
 
 def main():
@@ -182,37 +2716,193 @@ def main():
     parser.add_argument("-v", "--version", action="store_true", help="Show version.")                      
     parser.add_argument('directory', nargs=1, help='Base directory')
     parser.add_argument('wildcard', nargs=1, help='Unix style file name match')
-    parser.add_argument('regex', nargs=1, help='Regular expression')    
+    parser.add_argument('regex', nargs='*', help="""Regular expression, or
+        several searched in one pass, every match labelled with its pattern""")
+    parser.add_argument('--root', action='append', default=[], metavar='DIR',
+        help="""Also search DIR, e.g. another checkout, can be given several
+        times. All directories share the worker processes, their results
+        come in the order given, followed by a summary of each.""")
+    parser.add_argument('--file', '-f', action='append', default=[],
+        metavar='FILE', help="""Also search the patterns in FILE, one per
+        line. Literal patterns are merged into one trie shaped regex.""")
+    parser.add_argument('--fixed-strings', '-F', action='store_true',
+        help="""Take every pattern as a literal string""")
     parser.add_argument('--interactive', '-i', help="""Stop on every match, does
         not have effect when --replacement flag is set""", 
         action='store_true')
     parser.add_argument('--replacement', '-r', help="""Replacement string. 
         Regular expression captures can be used. If set, textfinder will attempt
-        to replace occurences in files. Will be run in interactive mode.""")
+        to replace occurences in files. Asks for every line unless --yes or
+        --dry-run is given.""")
+    parser.add_argument('--yes', '-y', action='store_true', help="""Replace
+        every occurence without asking. All files are planned in parallel
+        first and only then renamed over the originals.""")
+    parser.add_argument('--dry-run', '-n', action='store_true', help="""Show
+        what --replacement would change without writing anything""")
+    parser.add_argument('--jobs', '-j', type=int, help="""Number of worker
+        processes searching files, defaults to the number of CPUs""")
+    parser.add_argument('--binary', '-a', action='store_true', help="""Also
+        search binary files, i.e. files with a NUL byte in their first
+        %d bytes. They are skipped by default.""" % (BINARY_PROBE_SIZE,))
+    parser.add_argument('--max-filesize', '--max-size', type=parse_size, metavar='SIZE',
+        help="""Skip files larger than SIZE, e.g. 512k or 10M""")
+    parser.add_argument('--newer-than', type=parse_age, metavar='AGE',
+        help="""Only search files modified within AGE, e.g. 30m, 12h or 1d,
+        or since a date like 2024-05-01""")
+    parser.add_argument('--include', action='append', default=[],
+        metavar='GLOB', help="""Only search files whose name matches GLOB, or
+        one of the globs if given several times""")
+    parser.add_argument('--type', '-t', action='append', default=[],
+        choices=sorted(FILE_TYPES), metavar='TYPE', help="""Only search files
+        of TYPE, can be given several times. One of: %s""" % (', '.join(sorted(FILE_TYPES)),))
+    parser.add_argument('--no-ignore', action='store_true', help="""Do not
+        skip what .gitignore and .ignore files exclude, and search .git""")
+    parser.add_argument('--hidden', action='store_true', help="""Also search
+        hidden files and directories, whose name starts with a dot""")
+    parser.add_argument('--exclude', action='append', default=[],
+        metavar='GLOB', help="""Skip files whose name matches GLOB, can be
+        given several times""")
+    parser.add_argument('--exclude-dir', action='append', default=[],
+        metavar='GLOB', help="""Skip directories whose name matches GLOB, can
+        be given several times""")
+    parser.add_argument('--index', action='store_true', help="""Keep a
+        trigram index of the searched files, update it by modification time
+        and size, and only search files that can contain a match""")
+    parser.add_argument('--index-file', metavar='FILE', help="""Where the
+        index is stored, defaults to a file per directory below
+        ~/.cache/textfinder""")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--json', dest='format', action='store_const',
+        const='json', help="""Print one JSON object per matched line, with
+        the file, line number, byte offset of the line, and the column, byte
+        offset and text of every match""")
+    output.add_argument('--vimgrep', dest='format', action='store_const',
+        const='vimgrep', help="""Print every match as file:line:column:text,
+        the way vim's grepformat reads it""")
+    output.add_argument('--count', '-c', dest='format', action='store_const',
+        const='count', help="""Print the number of matched lines of every
+        matched file""")
+    output.add_argument('--files-with-matches', '-l', dest='format',
+        action='store_const', const='files', help="""Only print the names of
+        matched files, each file is read up to its first match""")
+    parser.add_argument('--after-context', '-A', type=int, metavar='NUM',
+        help="""Print NUM lines after every match""")
+    parser.add_argument('--before-context', '-B', type=int, metavar='NUM',
+        help="""Print NUM lines before every match""")
+    parser.add_argument('--context', '-C', type=int, default=0, metavar='NUM',
+        help="""Print NUM lines before and after every match""")
+    parser.add_argument('--multiline', '-U', action='store_true', help="""Let
+        matches span lines. Each file is decoded as a whole, ^ and $ match at
+        every line, and every line a match touches is printed.""")
+    parser.add_argument('--search-zip', '-z', action='store_true', help="""Also
+        search inside .gz, .bz2 and .xz files and the members of .zip
+        archives, decompressing them on the fly""")
+    parser.add_argument('--watch', action='store_true', help="""Keep
+        running after the search and search again the files that change,
+        printing their matches and the updated summary""")
+    parser.add_argument('--poll', action='store_true', help="""Watch by
+        polling modification times instead of inotify, e.g. on network file
+        systems""")
+    parser.add_argument('--color', choices=('auto', 'always', 'never'),
+        default='auto', help="""Color the output, by default only when it
+        goes to a terminal""")
+    parser.add_argument('--stats', action='store_true', help="""Add to the
+        summary the files searched and skipped, the bytes scanned, the time
+        spent walking, reading and matching, the throughput and the slowest
+        files. Reading and matching are summed over the worker processes.
+        Goes to stderr with the other output formats.""")
+    parser.add_argument('--profile', metavar='FILE', help="""Write a cProfile
+        dump of the run to FILE, e.g. for python -m pstats. Searches in this
+        process unless --jobs is given, so the profile covers the search.""")
 
-    args = parser.parse_args()
+    # options may also come between or after the patterns
+    args = parser.parse_intermixed_args()
+    args.format = args.format or 'pretty'
+    if args.format != 'pretty' and (args.interactive or args.replacement is not None):
+        parser.error('--interactive and --replacement need the default output')
+    if args.watch and (args.format != 'pretty' or args.replacement is not None):
+        parser.error('--watch only searches, with the default output')
+    if args.search_zip and args.replacement is not None:
+        parser.error('--replacement can not write into compressed files, drop --search-zip')
+    if args.multiline and args.replacement is not None:
+        parser.error('--replacement works on single lines, not with --multiline')
+    if args.after_context is None:
+        args.after_context = args.context
+    if args.before_context is None:
+        args.before_context = args.context
 
     if args.version:
         print(version_string())
         sys.exit(0)
 
+    for name in args.file:
+        with open(name, encoding='utf-8') as f:
+            args.regex.extend(line.rstrip('\r\n') for line in f if line.strip('\r\n'))
+
     if len(args.directory) == 0 or len(args.wildcard) == 0 or len(args.regex) == 0:
         print("Error: the following arguments are required: directory, wildcard, regex")
         sys.exit(2)
 
-    # valid directory?
-    if os.path.isdir(args.directory[0]) == False:
-        print('Error: Not a directory: %s' % (directory,))
-        sys.exit(2)
+    # valid directories?
+    directories = args.directory + args.root
+    for directory in directories:
+        if os.path.isdir(directory) == False:
+            print('Error: Not a directory: %s' % (directory,))
+            sys.exit(2)
+    try:
+        directories = distinct_roots(directories)
+    except ValueError as error:
+        parser.error('--root: %s' % (error,))
+
+    printer = Printer(args.format, {'always': True, 'never': False}.get(args.color),
+                      context=bool(args.after_context or args.before_context))
+
+    profile = None
+    if args.profile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
 
     # Run the finder function now.
     try:
-        finder = Textfinder(wildcard=args.wildcard[0], regex=args.regex[0],
-                    interactive=args.interactive, replacement=args.replacement)
-        finder.textfinder(args.directory[0])
-        finder.summary()
+        finder = Textfinder(wildcard=args.wildcard[0], regex=args.regex,
+                    interactive=args.interactive, replacement=args.replacement,
+                    jobs=args.jobs or (1 if args.profile else None),
+                    binary=args.binary,
+                    max_filesize=args.max_filesize, newer_than=args.newer_than,
+                    include=args.include, types=args.type,
+                    ignore_rules=not args.no_ignore, hidden=args.hidden,
+                    exclude=args.exclude, exclude_dir=args.exclude_dir,
+                    confirm=not args.yes, dry_run=args.dry_run, printer=printer,
+                    before=args.before_context, after=args.after_context,
+                    multiline=args.multiline, decompress=args.search_zip,
+                    fixed=args.fixed_strings, stats=args.stats,
+                    index_file=(args.index_file or default_index_file(args.directory[0])
+                                if args.index else None))
+        if args.watch:
+            finder.watch(directories, poll=args.poll)
+        else:
+            finder.textfinder(directories)
+            if args.format == 'pretty':
+                finder.summary()
+            elif args.stats:
+                sys.stderr.write(finder.statistics())
+        sys.stdout.flush()
     except KeyboardInterrupt:
         pass
+    except re.error as error:
+        parser.error('invalid pattern: %s' % (error,))
+    except BrokenProcessPool:
+        print('Error: A worker process died while searching')
+        sys.exit(1)
+    except BrokenPipeError:
+        # the reader went away, e.g. head; keep Python from reporting it
+        # again while flushing at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.profile)
 
 if __name__ == '__main__':
     main();
@@ -0,0 +1,321 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark for textfinder. Generates a synthetic source tree, runs a fixed
+set of queries over it and reports files/s, MB/s, where the time went and
+the peak memory of every query as JSON. Compare a run against an earlier
+one with --baseline to catch throughput regressions in the walker and the
+matcher.
+"""
+
+import os
+import sys
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import shutil
+import tempfile
+
+from textfinder import Printer, Textfinder
+
+
+# Queries run over the corpus, from cheap to expensive for the regex engine.
+QUERIES = (
+    ('literal', r'textfinder_needle'),
+    ('anchored', r'^\s*def \w+\('),
+    ('alternation', r'\b(?:alpha|beta|gamma|delta|epsilon)_\w+'),
+    ('ignorecase', r'(?i)fixme'),
+    ('backtracking', r'\w+\d+\w*\s*=\s*\w+\('),
+)
+
+# Shape of the corpus at --scale 1. Sizes are in bytes.
+SMALL_FILES = 4000
+SMALL_FILE_SIZE = (512, 8192)
+FILES_PER_DIR = 40
+HUGE_FILES = 2
+HUGE_FILE_SIZE = 24 << 20
+DEEP_LEVELS = 64
+BINARY_FILES = 200
+BINARY_FILE_SIZE = 64 << 10
+LONG_LINE_FILES = 20
+LONG_LINE_SIZE = 256 << 10
+LONG_LINES_PER_FILE = 4
+
+# One line in this many carries the needle of the literal query.
+NEEDLE_RATE = 500
+
+WORDS = ('alpha', 'beta', 'gamma', 'delta', 'epsilon', 'value', 'index',
+         'buffer', 'count', 'result', 'path', 'name', 'item', 'node', 'data',
+         'config', 'handler', 'offset', 'length', 'state', 'fixme', 'FixMe')
+
+CORPUS_MANIFEST = 'corpus.json'
+
+
+def _identifier(rng):
+    word = rng.choice(WORDS)
+    if rng.random() < 0.3:
+        word += '_' + rng.choice(WORDS)
+    if rng.random() < 0.2:
+        word += str(rng.randrange(100))
+    return word
+
+
+def _source_line(rng):
+    """
+    Returns a line of made up Python-like source, with its newline.
+    """
+    indent = ' ' * (4 * rng.randrange(4))
+    kind = rng.random()
+    if kind < 0.1:
+        line = 'def %s(%s, %s):' % (_identifier(rng), _identifier(rng), _identifier(rng))
+    elif kind < 0.5:
+        line = '%s = %s(%s)' % (_identifier(rng), _identifier(rng), _identifier(rng))
+    elif kind < 0.6:
+        line = '# %s %s %s' % (_identifier(rng), _identifier(rng), _identifier(rng))
+    elif kind < 0.8:
+        line = 'return %s + %d' % (_identifier(rng), rng.randrange(1000))
+    else:
+        line = 'if %s > %s:' % (_identifier(rng), _identifier(rng))
+    if rng.randrange(NEEDLE_RATE) == 0:
+        line += '  # textfinder_needle'
+    return indent + line + '\n'
+
+
+def _text(rng, lines, size):
+    """
+    Returns about size bytes of text drawn from a pool of lines.
+    """
+    parts = []
+    total = 0
+    while total < size:
+        line = rng.choice(lines)
+        parts.append(line)
+        total += len(line)
+    return ''.join(parts).encode('ascii')
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def generate_corpus(root, seed=0, scale=1.0):
+    """
+    Writes the synthetic tree below root: many small files in nested
+    directories, a few huge files, one deeply nested chain of directories,
+    binary noise and files with very long lines. The same seed and scale
+    always give the same tree. Returns a summary of what was written.
+    """
+    rng = random.Random(seed)
+    lines = [_source_line(rng) for _ in range(20000)]
+    files = 0
+    size = 0
+
+    for i in range(int(SMALL_FILES * scale)):
+        path = os.path.join(root, 'small', 'd%03d' % (i // FILES_PER_DIR),
+                            's%d' % (i % 4), 'f%05d.py' % (i,))
+        size += _write(path, _text(rng, lines, rng.randrange(*SMALL_FILE_SIZE)))
+        files += 1
+
+    for i in range(max(int(HUGE_FILES * scale), 1)):
+        path = os.path.join(root, 'huge', 'h%d.py' % (i,))
+        size += _write(path, _text(rng, lines, int(HUGE_FILE_SIZE * scale)))
+        files += 1
+
+    directory = os.path.join(root, 'deep')
+    for i in range(DEEP_LEVELS):
+        directory = os.path.join(directory, 'l%02d' % (i,))
+        size += _write(os.path.join(directory, 'f.py'), _text(rng, lines, 2048))
+        files += 1
+
+    for i in range(int(BINARY_FILES * scale)):
+        path = os.path.join(root, 'binary', 'b%04d.py' % (i,))
+        size += _write(path, rng.randbytes(BINARY_FILE_SIZE))
+        files += 1
+
+    for i in range(int(LONG_LINE_FILES * scale)):
+        path = os.path.join(root, 'long', 'min%03d.py' % (i,))
+        data = b''.join(_text(rng, lines, LONG_LINE_SIZE).replace(b'\n', b'; ') + b'\n'
+                        for _ in range(LONG_LINES_PER_FILE))
+        size += _write(path, data)
+        files += 1
+
+    return {'seed': seed, 'scale': scale, 'files': files, 'bytes': size}
+
+
+def prepare_corpus(root, seed, scale):
+    """
+    Reuses the corpus in root if it was generated with the same seed and
+    scale, otherwise generates it again.
+    """
+    manifest = os.path.join(root, CORPUS_MANIFEST)
+    try:
+        with open(manifest) as f:
+            corpus = json.load(f)
+        if corpus['seed'] == seed and corpus['scale'] == scale:
+            return corpus
+        shutil.rmtree(root)
+    except FileNotFoundError:
+        # never remove a directory that does not hold a corpus
+        if os.path.isdir(root) and os.listdir(root):
+            raise SystemExit('Error: Not empty and not a corpus: %s' % (root,))
+    except (OSError, ValueError, KeyError):
+        raise SystemExit('Error: Unreadable corpus manifest: %s' % (manifest,))
+
+    os.makedirs(root, exist_ok=True)
+    corpus = generate_corpus(root, seed, scale)
+    with open(manifest, 'w') as f:
+        json.dump(corpus, f)
+    return corpus
+
+
+def _peak_rss_kb():
+    """
+    Returns the peak resident memory of this process and of its finished
+    worker processes, in KiB.
+    """
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':
+        peak //= 1024   # bytes there
+    return peak
+
+
+def _measure(root, regex, jobs, queue):
+    """
+    Runs one query in a fresh process, so the peak memory is its own.
+    """
+    with open(os.devnull, 'w') as devnull:
+        finder = Textfinder(wildcard='*.py', regex=regex, jobs=jobs, stats=True,
+                            printer=Printer('count', False, stream=devnull))
+        finder.textfinder(root)
+    queue.put({
+        'files': finder.num_searched,
+        'bytes': finder.num_bytes,
+        'matches': finder.num_matches_strings,
+        'skipped': sum(finder.num_skipped.values()),
+        'seconds': finder.time_total,
+        'walk_seconds': finder.time_walk,
+        'read_seconds': finder.time_read,
+        'match_seconds': finder.time_match,
+        'peak_rss_kb': _peak_rss_kb(),
+    })
+
+
+def run_query(root, name, regex, jobs, repeat):
+    """
+    Runs a query repeat times and keeps the fastest run, and the highest
+    peak memory of all runs.
+    """
+    context = multiprocessing.get_context('spawn')
+    best = None
+    peak = 0
+    for _ in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=_measure, args=(root, regex, jobs, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        peak = max(peak, result['peak_rss_kb'])
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+
+    seconds = best['seconds'] or float('inf')
+    result = {'name': name, 'regex': regex}
+    result.update(best)
+    result.update({
+        'files_per_s': round(best['files'] / seconds, 1),
+        'mb_per_s': round(best['bytes'] / 1e6 / seconds, 1),
+        'peak_rss_kb': peak,
+    })
+    for key in ('seconds', 'walk_seconds', 'read_seconds', 'match_seconds'):
+        result[key] = round(result[key], 4)
+    return result
+
+
+def regressions(report, baseline, tolerance):
+    """
+    Returns a message for every query whose throughput dropped by more than
+    tolerance, a fraction, against the baseline report.
+    """
+    before = {query['name']: query for query in baseline['queries']}
+    messages = []
+    for query in report['queries']:
+        old = before.get(query['name'])
+        if old is None or not old['mb_per_s']:
+            continue
+        change = query['mb_per_s'] / old['mb_per_s'] - 1
+        if change < -tolerance:
+            messages.append('%s: %.1f MB/s, was %.1f MB/s (%+.0f%%)' % (
+                query['name'], query['mb_per_s'], old['mb_per_s'], change * 100))
+    return messages
+
+
+def main():
+    """
+    Runs the benchmark and prints or writes the JSON report.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark textfinder on a synthetic source tree.",
+                                     epilog='example: textfinder_bench.py --scale 0.5 --output before.json')
+    parser.add_argument('--corpus', metavar='DIR', help="""Where the corpus
+        is generated and reused by later runs with the same seed and scale.
+        Defaults to a temporary directory removed afterwards.""")
+    parser.add_argument('--seed', type=int, default=0, help="""Seed of the
+        generated corpus""")
+    parser.add_argument('--scale', type=float, default=1.0, help="""Scale the
+        number and size of the generated files, 1 makes about 150 MB""")
+    parser.add_argument('--query', action='append', choices=[name for name, _ in QUERIES],
+        help="""Only run this query, can be given several times""")
+    parser.add_argument('--jobs', '-j', type=int, help="""Number of worker
+        processes, defaults to the number of CPUs""")
+    parser.add_argument('--repeat', type=int, default=3, help="""Run every
+        query this many times and report the fastest run""")
+    parser.add_argument('--output', '-o', metavar='FILE', help="""Write the
+        report to FILE instead of stdout""")
+    parser.add_argument('--baseline', metavar='FILE', help="""Compare with a
+        report written earlier, and exit with status 1 if a query got slower""")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="""Drop
+        in MB/s against --baseline that still passes, as a fraction""")
+    args = parser.parse_args()
+
+    root = args.corpus or tempfile.mkdtemp(prefix='textfinder-bench-')
+    try:
+        corpus = prepare_corpus(root, args.seed, args.scale)
+        corpus['path'] = root
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'jobs': args.jobs or os.cpu_count(),
+            'corpus': corpus,
+            'queries': [run_query(root, name, regex, args.jobs, max(args.repeat, 1))
+                        for name, regex in QUERIES
+                        if not args.query or name in args.query],
+        }
+    finally:
+        if not args.corpus:
+            shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=2) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        messages = regressions(report, baseline, args.tolerance)
+        for message in messages:
+            print('Regression: %s' % (message,), file=sys.stderr)
+        if messages:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()